@@ -0,0 +1,3 @@
+# Ambiti votati dalla giuria tecnica, nell'ordine in cui vengono chiesti.
+# In un modulo a parte così journal.py e bench/ li usano senza importare main.py.
+TECHNICAL_AMBITI = ["Intonazione", "Interpretazione", "Tecninca Musicale/Strumentale", "Presenza Scenica"]
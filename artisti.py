@@ -0,0 +1,120 @@
+import re
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_CATEGORY = "Giovani Promesse"
+ARTISTS_PER_PAGE = 10
+
+_KEY_RE = re.compile(r"^artist(\d+)$")
+
+
+class ArtistStore(Mapping):
+    """Elenco degli artisti indicizzato per chiave e per categoria.
+
+    Si usa come un dict in sola lettura (`store[key]`, `key in store`,
+    `store.items()`); le modifiche passano da `add` e `remove`, che
+    mantengono aggiornato l'indice per categoria. Le chiavi nuove sono
+    `artist<N>` con N crescente e non vengono mai riutilizzate, così i voti
+    di un artista rimosso non finiscono a uno nuovo: il contatore
+    `next_id` va salvato insieme all'artista aggiunto e ripassato al
+    costruttore, perché dopo una rimozione non si può ricavare dalle chiavi
+    rimaste.
+    """
+
+    def __init__(self, artists: Optional[Dict[str, dict]] = None, next_id: int = 1):
+        self._artists: Dict[str, dict] = {}
+        self._by_category: Dict[str, Dict[str, dict]] = {}
+        self._next_id = max(int(next_id or 1), 1)
+        self._ordered: Optional[List[str]] = None
+        self.version = 0
+        for key, artist in (artists or {}).items():
+            self._insert(key, dict(artist))
+
+    def __getitem__(self, key: str) -> dict:
+        return self._artists[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._artists)
+
+    def __len__(self) -> int:
+        return len(self._artists)
+
+    @property
+    def next_id(self) -> int:
+        """N della prossima chiave `artist<N>`."""
+        return self._next_id
+
+    def add(self, artist: dict, next_id: int = 1) -> str:
+        """Aggiunge l'artista e restituisce la nuova chiave (almeno `artist<next_id>`)."""
+        self._next_id = max(self._next_id, next_id)
+        key = f"artist{self._next_id}"
+        self._insert(key, dict(artist))
+        return key
+
+    def replace(self, artists: Dict[str, dict], next_id: int = 1) -> None:
+        """Sostituisce l'elenco (es. riletto dallo stato condiviso); il contatore non torna indietro."""
+        self._artists = {}
+        self._by_category = {}
+        self._next_id = max(self._next_id, int(next_id or 1))
+        for key, artist in artists.items():
+            self._insert(key, dict(artist))
+        self._ordered = None
+        self.version += 1
+
+    def remove(self, key: str) -> dict:
+        artist = self._artists.pop(key)
+        category = self._by_category.get(artist.get("categoria", DEFAULT_CATEGORY), {})
+        category.pop(key, None)
+        if not category:
+            self._by_category.pop(artist.get("categoria", DEFAULT_CATEGORY), None)
+        self._ordered = None
+        self.version += 1
+        return artist
+
+    def by_category(self, categoria: str) -> Dict[str, dict]:
+        return self._by_category.get(categoria, {})
+
+    def categories(self) -> List[str]:
+        return list(self._by_category)
+
+    def ordered_keys(self) -> List[str]:
+        """Chiavi raggruppate per categoria, ricalcolate solo se l'elenco cambia."""
+        if self._ordered is None:
+            self._ordered = [key for category in self._by_category.values() for key in category]
+        return self._ordered
+
+    def page(self, page: int, per_page: int = ARTISTS_PER_PAGE) -> Tuple[List[str], int, int]:
+        """Chiavi della pagina richiesta; restituisce (chiavi, pagina effettiva, numero di pagine)."""
+        keys = self.ordered_keys()
+        pages = max(1, -(-len(keys) // per_page))
+        page = min(max(page, 0), pages - 1)
+        return keys[page * per_page:(page + 1) * per_page], page, pages
+
+    def to_dict(self) -> Dict[str, dict]:
+        return {key: dict(artist) for key, artist in self._artists.items()}
+
+    def _insert(self, key: str, artist: dict) -> None:
+        self._artists[key] = artist
+        self._by_category.setdefault(artist.get("categoria", DEFAULT_CATEGORY), {})[key] = artist
+        match = _KEY_RE.match(key)
+        if match:
+            self._next_id = max(self._next_id, int(match.group(1)) + 1)
+        self._ordered = None
+        self.version += 1
+
+
+class KeyboardCache:
+    """Tastiere per pagina, ricostruite solo quando l'elenco degli artisti cambia."""
+
+    def __init__(self):
+        self._version: Optional[int] = None
+        self._keyboards: Dict[Tuple[str, int], Any] = {}
+
+    def get(self, artists: ArtistStore, kind: str, page: int, build: Callable[[], Any]) -> Any:
+        if artists.version != self._version:
+            self._keyboards.clear()
+            self._version = artists.version
+        keyboard = self._keyboards.get((kind, page))
+        if keyboard is None:
+            keyboard = self._keyboards[(kind, page)] = build()
+        return keyboard
@@ -0,0 +1,119 @@
+"""Aggregati dei voti su dict (implementazione precedente a VoteMatrix).
+
+Non è più usata dal bot: resta come riferimento per i benchmark
+(bench/micro.py, bench/votematrix_compare.py), per confrontare tempi,
+memoria e risultati con VoteMatrix.
+"""
+from typing import Dict, Tuple
+
+
+class RunningMean:
+    __slots__ = ("count", "total")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+
+    def remove(self, value: float) -> None:
+        self.count -= 1
+        self.total -= value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class VoteAggregates:
+    """Medie dei voti aggiornate in O(1) a ogni voto.
+
+    Per ogni artista mantiene conteggio e somma dei voti popolari, delle
+    medie dei singoli giudici tecnici (come in stop_voting_handler: la
+    scheda di un giudice vale la media degli ambiti votati) e di ogni
+    ambito. `version` cambia a ogni voto, così chi mette in cache una
+    classifica sa quando ricalcolarla.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._popolare: Dict[str, RunningMean] = {}
+        self._tecnica: Dict[str, RunningMean] = {}
+        self._ambiti: Dict[Tuple[str, str], RunningMean] = {}
+        # media parziale di ogni scheda tecnica, per poterla sostituire
+        self._ballots: Dict[Tuple[str, object], RunningMean] = {}
+
+    @classmethod
+    def from_votes(cls, votes_popolare: dict, votes_tecnica: dict) -> "VoteAggregates":
+        aggregates = cls()
+        aggregates.rebuild(votes_popolare, votes_tecnica)
+        return aggregates
+
+    def rebuild(self, votes_popolare: dict, votes_tecnica: dict) -> None:
+        """Ricostruisce tutti gli aggregati dai voti salvati (es. all'avvio)."""
+        self.clear()
+        for artist_key, users in votes_popolare.items():
+            for user_id, score in users.items():
+                self.add_popolare(artist_key, user_id, score)
+        for artist_key, users in votes_tecnica.items():
+            for user_id, aspects in users.items():
+                for ambito, score in aspects.items():
+                    self.add_tecnica(artist_key, user_id, ambito, score)
+
+    def clear(self) -> None:
+        self._popolare.clear()
+        self._tecnica.clear()
+        self._ambiti.clear()
+        self._ballots.clear()
+        self.version += 1
+
+    def add_popolare(self, artist_key: str, user_id, score: float) -> None:
+        self._popolare.setdefault(artist_key, RunningMean()).add(score)
+        self.version += 1
+
+    def add_tecnica(self, artist_key: str, user_id, ambito: str, score: float) -> None:
+        self._ambiti.setdefault((artist_key, ambito), RunningMean()).add(score)
+        artist_mean = self._tecnica.setdefault(artist_key, RunningMean())
+        ballot = self._ballots.setdefault((artist_key, user_id), RunningMean())
+        if ballot.count:
+            artist_mean.remove(ballot.mean)
+        ballot.add(score)
+        artist_mean.add(ballot.mean)
+        self.version += 1
+
+    def average(self, artist_key: str, jury_type: str) -> float:
+        means = self._popolare if jury_type == "popolare" else self._tecnica
+        mean = means.get(artist_key)
+        return mean.mean if mean else 0.0
+
+    def count(self, artist_key: str, jury_type: str) -> int:
+        means = self._popolare if jury_type == "popolare" else self._tecnica
+        mean = means.get(artist_key)
+        return mean.count if mean else 0
+
+    def ambito_average(self, artist_key: str, ambito: str) -> float:
+        mean = self._ambiti.get((artist_key, ambito))
+        return mean.mean if mean else 0.0
+
+    def ranking(self, artists: Dict[str, dict],
+                default_category: str = "Giovani Promesse") -> Dict[str, list]:
+        """Classifica per categoria: liste di (media, artist_key, media popolare, media tecnica)."""
+        if hasattr(artists, "by_category"):
+            # ArtistStore: gruppi già indicizzati per categoria
+            groups = {categoria: artists.by_category(categoria) for categoria in artists.categories()}
+        else:
+            groups = {}
+            for artist_key, artist in artists.items():
+                groups.setdefault(artist.get("categoria", default_category), {})[artist_key] = artist
+        ranking: Dict[str, list] = {}
+        for categoria, members in groups.items():
+            entries = ranking[categoria] = []
+            for artist_key in members:
+                avg_pop = self.average(artist_key, "popolare")
+                avg_tech = self.average(artist_key, "tecnica")
+                entries.append(((avg_pop + avg_tech) / 2, artist_key, avg_pop, avg_tech))
+        for entries in ranking.values():
+            entries.sort(key=lambda x: x[0], reverse=True)
+        return ranking
@@ -0,0 +1,236 @@
+"""Finti servizi esterni per i benchmark: Bot API di Telegram, Firebase RTDB e Cloudinary.
+
+install_fake_firebase e install_fake_cloudinary registrano i moduli finti
+in sys.modules; vanno chiamate prima del primo accesso dello store o
+dell'uploader (l'SDK viene importato solo al primo utilizzo).
+"""
+import asyncio
+import copy
+import sys
+import threading
+import time
+import types
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+
+# --- Firebase RTDB ---------------------------------------------------------
+
+class FakeDatabase:
+    """Albero JSON in memoria con la latenza simulata di ogni chiamata."""
+
+    def __init__(self, latency: float = 0.0, data: Optional[dict] = None):
+        self.latency = latency
+        self.data: dict = data or {}
+        self.calls: Counter = Counter()
+        self._lock = threading.RLock()
+
+    def _wait(self, op: str) -> None:
+        self.calls[op] += 1
+        if self.latency:
+            # l'SDK vero è bloccante: la latenza si paga nel thread chiamante
+            time.sleep(self.latency)
+
+    def _parts(self, path: str) -> list:
+        return [part for part in path.split("/") if part]
+
+    def get(self, path: str) -> Any:
+        with self._lock:
+            node = self.data
+            for part in self._parts(path):
+                if not isinstance(node, dict) or part not in node:
+                    return None
+                node = node[part]
+            return copy.deepcopy(node)
+
+    def set(self, path: str, value: Any) -> None:
+        with self._lock:
+            parts = self._parts(path)
+            if not parts:
+                self.data = copy.deepcopy(value) if isinstance(value, dict) else {}
+                return
+            node = self.data
+            for part in parts[:-1]:
+                child = node.get(part)
+                if not isinstance(child, dict):
+                    child = node[part] = {}
+                node = child
+            if value is None or value == {} or value == []:
+                node.pop(parts[-1], None)
+            else:
+                node[parts[-1]] = copy.deepcopy(value)
+
+
+class FakeReference:
+    def __init__(self, database: FakeDatabase, path: str):
+        self._db = database
+        self.path = path.strip("/")
+
+    def child(self, path: str) -> "FakeReference":
+        return FakeReference(self._db, f"{self.path}/{path}")
+
+    def get(self, shallow: bool = False):
+        self._db._wait("get")
+        value = self._db.get(self.path)
+        if shallow and isinstance(value, dict):
+            return {key: True for key in value}
+        return value
+
+    def set(self, value) -> None:
+        self._db._wait("set")
+        self._db.set(self.path, value)
+
+    def update(self, changes: dict) -> None:
+        self._db._wait("update")
+        with self._db._lock:
+            for path, value in changes.items():
+                self._db.set(f"{self.path}/{path}", value)
+
+    def transaction(self, update):
+        self._db._wait("transaction")
+        with self._db._lock:
+            value = update(self._db.get(self.path))
+            self._db.set(self.path, value)
+            return value
+
+
+def install_fake_firebase(database: FakeDatabase) -> None:
+    apps = []
+
+    def get_app():
+        if not apps:
+            raise ValueError("Nessuna app Firebase inizializzata")
+        return apps[0]
+
+    def initialize_app(credential=None, options=None):
+        apps.append(object())
+        return apps[0]
+
+    firebase_admin = types.ModuleType("firebase_admin")
+    credentials = types.ModuleType("firebase_admin.credentials")
+    db = types.ModuleType("firebase_admin.db")
+    credentials.Certificate = lambda path: path
+    db.reference = lambda path="": FakeReference(database, path)
+    firebase_admin.get_app = get_app
+    firebase_admin.initialize_app = initialize_app
+    firebase_admin.credentials = credentials
+    firebase_admin.db = db
+    sys.modules.update({
+        "firebase_admin": firebase_admin,
+        "firebase_admin.credentials": credentials,
+        "firebase_admin.db": db,
+    })
+
+
+# --- Cloudinary ------------------------------------------------------------
+
+def install_fake_cloudinary(latency: float = 0.0) -> Counter:
+    """Registra un SDK Cloudinary finto; restituisce il contatore delle chiamate."""
+    calls: Counter = Counter()
+
+    def upload(source, **options):
+        calls["upload"] += 1
+        time.sleep(latency)
+        public_id = f"{options.get('folder', 'bench')}/img{calls['upload']}"
+        return {"public_id": public_id, "secure_url": f"https://res.cloudinary.invalid/{public_id}.jpg"}
+
+    def upload_large(file, chunk_size=20_000_000, **options):
+        # come l'SDK: un upload per blocco letto dal file
+        while file.read(chunk_size):
+            calls["upload_large_part"] += 1
+        return upload(None, **options)
+
+    def destroy(public_id, **options):
+        calls["destroy"] += 1
+        time.sleep(latency)
+        return {"result": "ok"}
+
+    cloudinary = types.ModuleType("cloudinary")
+    uploader = types.ModuleType("cloudinary.uploader")
+    cloudinary.config = lambda **options: None
+    uploader.upload = upload
+    uploader.upload_large = upload_large
+    uploader.destroy = destroy
+    cloudinary.uploader = uploader
+    sys.modules.update({"cloudinary": cloudinary, "cloudinary.uploader": uploader})
+    return calls
+
+
+# --- Bot API di Telegram -----------------------------------------------------
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "SakuraBot", "username": "sakura_bench_bot"}
+
+
+class FakeBotApi:
+    """Server HTTP che risponde ai metodi della Bot API usati dal bot.
+
+    Ogni chiamata viene contata per metodo e consegnata nella `inbox` della
+    chat destinataria, da cui gli utenti simulati leggono le risposte.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.inbox: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.webhook_url = ""
+        self._message_id = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        return app
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if not params and request.can_read_body:
+            params = await request.json()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self._result(method, params)
+        chat_id = self._recipient(method, params)
+        if chat_id is not None:
+            self.inbox[chat_id].put_nowait((time.perf_counter(), method, params))
+        return web.json_response({"ok": True, "result": result})
+
+    def _recipient(self, method: str, params: dict) -> Optional[int]:
+        if "chat_id" in params:
+            return int(params["chat_id"])
+        if method == "answerCallbackQuery":
+            # gli id dei callback generati dal carico sono "<chat_id>:<n>"
+            return int(str(params["callback_query_id"]).split(":")[0])
+        return None
+
+    def _result(self, method: str, params: dict) -> Any:
+        if method == "getMe":
+            return {**BOT_USER, "can_join_groups": False, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+            return True
+        if method in ("sendMessage", "sendPhoto", "editMessageText"):
+            return self._message(method, params)
+        return True
+
+    def _message(self, method: str, params: dict) -> dict:
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+        }
+        if method == "sendPhoto":
+            photo = str(params.get("photo", ""))
+            # stesso file_id per la stessa foto, come farebbe Telegram
+            file_id = photo if photo.startswith("fid-") else f"fid-{abs(hash(photo))}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 800}]
+            message["caption"] = params.get("caption", "")
+        else:
+            message["text"] = params.get("text", "")
+        return message
@@ -0,0 +1,323 @@
+"""Test di carico end-to-end del webhook.
+
+Avvia il server aiohttp di main.py contro una Bot API finta e versioni in
+memoria di Firebase e Cloudinary (bench/fakes.py), poi simula una serata di
+votazioni:
+
+1. il proprietario e N giudici si registrano (/start + password);
+2. per ogni artista il proprietario lo seleziona e il profilo viene inviato
+   ai giudici;
+3. tutti i giudici votano insieme (popolari un voto, tecnici 4 ambiti);
+4. il proprietario chiude le votazioni.
+
+Per ogni tipo di update riporta p50/p95/p99 della latenza di risposta del
+webhook (POST -> 200) e della latenza di elaborazione (POST -> prima
+chiamata alla Bot API verso quella chat), il throughput e le chiamate
+effettuate verso i servizi esterni.
+
+Esempio:
+    python bench/loadtest.py --judges 200 --tecnica-ratio 0.3 --artists 5 --api-latency-ms 40
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fakes import FakeBotApi, FakeDatabase, install_fake_cloudinary, install_fake_firebase  # noqa: E402
+
+TOKEN = "123456:BENCH"
+REPLY_TIMEOUT = 30
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summary(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values, default=0.0) * 1000, 2),
+    }
+
+
+class Client:
+    """Utenti simulati che inviano update al webhook e leggono le risposte dalla Bot API finta."""
+
+    def __init__(self, session: ClientSession, url: str, api: FakeBotApi, redeliver: float = 0.0,
+                 secret: str = ""):
+        self.session = session
+        self.url = url
+        self.headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+        self.api = api
+        self.redeliver = redeliver
+        self.redelivered = 0
+        self._random = random.Random(3)
+        self.ack: Dict[str, List[float]] = defaultdict(list)
+        self.reply: Dict[str, List[float]] = defaultdict(list)
+        self.timeouts = 0
+        self._ids = itertools.count(1)
+
+    def _user(self, chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": f"Utente {chat_id}"}
+
+    def message(self, chat_id: int, text: str) -> dict:
+        update_id = next(self._ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, chat_id: int, data: str) -> dict:
+        update_id = next(self._ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": f"{chat_id}:{update_id}",
+            "from": self._user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "SakuraBot"},
+                "text": "menu",
+            },
+        }}
+
+    def drain(self, chat_id: int) -> None:
+        inbox = self.api.inbox[chat_id]
+        while not inbox.empty():
+            inbox.get_nowait()
+
+    async def receive(self, chat_id: int):
+        try:
+            return await asyncio.wait_for(self.api.inbox[chat_id].get(), REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+
+    async def send(self, kind: str, chat_id: int, update: dict, wait_reply: bool = True) -> None:
+        self.drain(chat_id)
+        started = time.perf_counter()
+        async with self.session.post(self.url, json=update, headers=self.headers) as response:
+            await response.read()
+            if response.status != 200:
+                raise RuntimeError(f"Webhook ha risposto {response.status} all'update {update['update_id']}")
+        self.ack[kind].append(time.perf_counter() - started)
+        if self._random.random() < self.redeliver:
+            # Telegram rimanda lo stesso update se la prima risposta non gli è arrivata
+            async with self.session.post(self.url, json=update, headers=self.headers) as response:
+                await response.read()
+            self.redelivered += 1
+        if wait_reply:
+            received = await self.receive(chat_id)
+            if received is not None:
+                self.reply[kind].append(received[0] - started)
+
+
+async def run_workload(client: Client, args) -> dict:
+    owner = 1000
+    judges = list(range(2000, 2000 + args.judges))
+    tecnica_count = round(args.judges * args.tecnica_ratio)
+    tecnica = set(judges[:tecnica_count])
+    phases = {}
+
+    async def register(chat_id: int, password: str) -> None:
+        await client.send("start", chat_id, client.message(chat_id, "/start"))
+        await client.send("login", chat_id, client.message(chat_id, password))
+
+    started = time.perf_counter()
+    await register(owner, "9999")
+    await asyncio.gather(*(register(chat_id, "5678" if chat_id in tecnica else "1234") for chat_id in judges))
+    phases["registration_s"] = time.perf_counter() - started
+
+    async def vote(chat_id: int, delivered: List[float]) -> None:
+        profile = await client.receive(chat_id)
+        if profile is None:
+            return
+        delivered.append(profile[0])
+        if chat_id in tecnica:
+            for _ in range(4):
+                await client.send("vote_tecnica", chat_id, client.message(chat_id, str(args.score)))
+        else:
+            await client.send("vote_popolare", chat_id, client.message(chat_id, str(args.score)))
+
+    fanout, voting = [], []
+    for n in range(1, args.artists + 1):
+        for chat_id in judges:
+            client.drain(chat_id)
+        delivered: List[float] = []
+        voters = [asyncio.create_task(vote(chat_id, delivered)) for chat_id in judges]
+        selected = time.perf_counter()
+        await client.send("select_artist", owner, client.callback(owner, f"artist{n}"))
+        await asyncio.gather(*voters)
+        voting.append(time.perf_counter() - selected)
+        # tempo per recapitare il profilo a tutti i giudici
+        fanout.append(max(delivered, default=selected) - selected)
+    phases["profile_fanout_max_s"] = max(fanout, default=0.0)
+    phases["voting_s"] = sum(voting)
+
+    started = time.perf_counter()
+    await client.send("stop_voting", owner, client.callback(owner, "stop_voting"))
+    phases["stop_voting_s"] = time.perf_counter() - started
+    return {key: round(value, 3) for key, value in phases.items()}
+
+
+def seed_database(args) -> FakeDatabase:
+    artists = {
+        f"artist{n}": {
+            "nome": f"Artista {n}",
+            "età": 20 + n % 10,
+            "canzone": f"Canzone {n}",
+            "categoria": "Big" if n % 2 else "Giovani Promesse",
+            "foto": f"https://res.cloudinary.invalid/artisti/{n}.jpg",
+        }
+        for n in range(1, args.artists + 1)
+    }
+    return FakeDatabase(latency=args.firebase_latency_ms / 1000, data={"bot_data": {"artists": artists}})
+
+
+async def wait_ready(session: ClientSession, base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        async with session.get(f"{base_url}/") as response:
+            if response.status == 200:
+                return
+        await asyncio.sleep(0.05)
+    raise RuntimeError("Il bot non è diventato pronto in tempo")
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def run(args) -> dict:
+    database = seed_database(args)
+    install_fake_firebase(database)
+    cloudinary_calls = install_fake_cloudinary(args.cloudinary_latency_ms / 1000)
+    api = FakeBotApi(latency=args.api_latency_ms / 1000)
+    api_runner = await start_site(api.make_app(), args.api_port)
+
+    os.environ.update({
+        "TOKEN": TOKEN,
+        "WEBHOOK_URL": f"http://127.0.0.1:{args.port}",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.api_port}",
+        "FIREBASE_DATABASE_URL": "https://bench.invalid",
+    })
+    import main  # letto dopo le variabili d'ambiente
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    bot_runner = await start_site(main.create_web_app(), args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        async with ClientSession() as session:
+            await wait_ready(session, base_url)
+            client = Client(session, f"{base_url}{main.WEBHOOK_PATH}", api, redeliver=args.redeliver,
+                            secret=main.WEBHOOK_SECRET)
+            started = time.perf_counter()
+            phases = await run_workload(client, args)
+            elapsed = time.perf_counter() - started
+            async with session.get(f"{base_url}/stats") as response:
+                server_stats = await response.json()
+            if args.metrics:
+                async with session.get(f"{base_url}/metrics") as response:
+                    Path(args.metrics).write_text(await response.text())
+    finally:
+        await bot_runner.cleanup()
+        await api_runner.cleanup()
+
+    updates = sum(len(values) for values in client.ack.values())
+    return {
+        "config": vars(args),
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(updates / elapsed, 1) if elapsed else 0.0,
+        "phases": phases,
+        "reply_timeouts": client.timeouts,
+        "redelivered": client.redelivered,
+        "ack_latency": {kind: summary(values) for kind, values in client.ack.items()},
+        "reply_latency": {kind: summary(values) for kind, values in client.reply.items()},
+        "bot_api_calls": dict(api.calls),
+        "firebase_calls": dict(database.calls),
+        "cloudinary_calls": dict(cloudinary_calls),
+        "server": server_stats,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"Update inviati: {result['updates']} in {result['elapsed_s']} s "
+          f"({result['throughput_ups']} update/s), risposte mancate: {result['reply_timeouts']}")
+    print(f"Fasi: {result['phases']}")
+    if result["redelivered"]:
+        print(f"Update riconsegnati: {result['redelivered']}")
+    for title, key in (("Latenza webhook (POST -> 200)", "ack_latency"),
+                       ("Latenza di elaborazione (POST -> prima risposta)", "reply_latency")):
+        print(f"\n{title}")
+        print(f"  {'update':<15}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for kind, row in result[key].items():
+            print(f"  {kind:<15}{row['count']:>7}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+                  f"{row['p99_ms']:>10}{row['max_ms']:>10}")
+    print(f"\nChiamate Bot API: {result['bot_api_calls']}")
+    print(f"Chiamate Firebase: {result['firebase_calls']}")
+    print(f"Chiamate Cloudinary: {result['cloudinary_calls']}")
+    print(f"Server: {result['server']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Test di carico del webhook di SakuraBot")
+    parser.add_argument("--judges", type=int, default=50, help="numero di giudici")
+    parser.add_argument("--tecnica-ratio", type=float, default=0.2, help="quota di giudici tecnici")
+    parser.add_argument("--artists", type=int, default=3, help="artisti da votare")
+    parser.add_argument("--score", type=int, default=8, help="voto inviato dai giudici")
+    parser.add_argument("--api-latency-ms", type=float, default=30, help="latenza simulata della Bot API")
+    parser.add_argument("--firebase-latency-ms", type=float, default=20, help="latenza simulata di Firebase")
+    parser.add_argument("--cloudinary-latency-ms", type=float, default=100, help="latenza simulata di Cloudinary")
+    parser.add_argument("--redeliver", type=float, default=0.0,
+                        help="quota di update inviati due volte, come le riconsegne di Telegram")
+    parser.add_argument("--port", type=int, default=18443, help="porta del webhook")
+    parser.add_argument("--api-port", type=int, default=18444, help="porta della Bot API finta")
+    parser.add_argument("--json", metavar="FILE", help="salva i risultati in JSON")
+    parser.add_argument("--metrics", metavar="FILE", help="salva l'output di /metrics a fine test")
+    parser.add_argument("--verbose", action="store_true", help="mostra i log del bot")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Micro-benchmark delle funzioni pure sul percorso dei voti.
+
+Misura tempo per chiamata e memoria allocata (picco di tracemalloc) di
+inserimento dei voti e classifica su VoteMatrix, estrazione del public_id
+Cloudinary, testi di benvenuto e codec JSON (decodifica di un update del
+webhook, codifica dello snapshot dei voti) su dataset generati da 10 a 100k
+voti. I casi reference_* misurano gli aggregati su dict di
+bench/aggregates.py, non più usati dal bot, come termine di paragone.
+
+    python bench/micro.py                 # esegue e stampa i risultati
+    python bench/micro.py --save          # aggiorna bench/baseline.json
+    python bench/micro.py --compare       # confronta con la baseline (exit 1 se peggiora)
+
+La baseline dipende dalla macchina: va rigenerata con --save prima di
+confrontare un'ottimizzazione sulla stessa macchina.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TOKEN", "123456:BENCH")
+
+import codec  # noqa: E402
+import main  # noqa: E402
+from artisti import ArtistStore  # noqa: E402
+from aggregates import VoteAggregates  # noqa: E402
+from classifica import StandingsCache, render_ranking  # noqa: E402
+from votematrix import VoteMatrix  # noqa: E402
+from scoring import ScoringConfig, ScoringEngine  # noqa: E402
+from text import get_benvenuto_popolare_text, get_benvenuto_prop_text, get_benvenuto_tecnica_text, welcome_text  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+CATEGORIES = ["Big", "Giovani Promesse"]
+
+
+def make_dataset(votes: int, seed: int = 42) -> Tuple[ArtistStore, dict, dict]:
+    """`votes` voti popolari e `votes` voti tecnici (per ambito) distribuiti su fino a 50 artisti."""
+    rng = random.Random(seed)
+    n_artists = min(50, max(1, votes // 10))
+    artists = ArtistStore({
+        f"artist{n}": {"nome": f"Artista_{n}", "età": 20, "canzone": f"Canzone {n}",
+                       "categoria": CATEGORIES[n % len(CATEGORIES)], "foto": ""}
+        for n in range(1, n_artists + 1)
+    })
+    keys = list(artists)
+    votes_popolare: Dict[str, dict] = {key: {} for key in keys}
+    for i in range(votes):
+        votes_popolare[keys[i % n_artists]][100_000 + i // n_artists] = rng.randint(1, 10)
+    votes_tecnica: Dict[str, dict] = {key: {} for key in keys}
+    ambiti = main.TECHNICAL_AMBITI
+    for i in range(votes):
+        ballot_index, ambito = divmod(i, len(ambiti))
+        artist_key = keys[ballot_index % n_artists]
+        user_id = 200_000 + ballot_index // n_artists
+        votes_tecnica[artist_key].setdefault(user_id, {})[ambiti[ambito]] = rng.randint(1, 10)
+    return artists, votes_popolare, votes_tecnica
+
+
+UPDATE = {
+    "update_id": 815_000_123,
+    "message": {
+        "message_id": 4242,
+        "date": 1_760_000_000,
+        "chat": {"id": 123_456_789, "type": "private", "first_name": "Giudice", "username": "giudice_popolare"},
+        "from": {"id": 123_456_789, "is_bot": False, "first_name": "Giudice", "username": "giudice_popolare",
+                 "language_code": "it"},
+        "text": "8",
+    },
+}
+
+
+def cases(size: int) -> Dict[str, Callable[[], object]]:
+    artists, votes_popolare, votes_tecnica = make_dataset(size)
+    aggregates = VoteAggregates.from_votes(votes_popolare, votes_tecnica)
+    matrix = VoteMatrix.from_votes(main.TECHNICAL_AMBITI, votes_popolare, votes_tecnica)
+    ranking = matrix.ranking(artists)
+    trimmed = VoteMatrix.from_votes(main.TECHNICAL_AMBITI, votes_popolare, votes_tecnica)
+    trimmed.set_scoring(ScoringEngine(ScoringConfig(method="troncata", zscore=True)))
+    standings = StandingsCache(matrix)
+    standings.get("*Classifica*", artists)
+    urls = [f"https://res.cloudinary.com/demo/image/upload/v1712{i}/artisti/foto_{i}.jpg"
+            for i in range(1000)]
+    user = SimpleNamespace(first_name="Giudice_con*caratteri[speciali]", id=123456)
+    # update di un voto come arriva dal webhook e snapshot del registro dei voti
+    raw_update = codec.get_codec("json").dumps(UPDATE)
+    snapshot = {"offset": 0, "votes_popolare": votes_popolare, "votes_tecnica": votes_tecnica}
+    codecs = {name: codec.get_codec(name) for name in codec.available()}
+    update = SimpleNamespace(effective_user=user, effective_chat=user)
+
+    def matrix_add_popolare():
+        # percorso di un voto popolare (vote_handler): inserimento nella matrice
+        fresh = VoteMatrix(main.TECHNICAL_AMBITI)
+        for artist_key, users in votes_popolare.items():
+            for user_id, score in users.items():
+                fresh.add_popolare(artist_key, user_id, score)
+
+    def matrix_add_tecnica():
+        # percorso di un voto tecnico: un inserimento per ambito
+        fresh = VoteMatrix(main.TECHNICAL_AMBITI)
+        for artist_key, users in votes_tecnica.items():
+            for user_id, aspects in users.items():
+                for ambito, score in aspects.items():
+                    fresh.add_tecnica(artist_key, user_id, ambito, score)
+
+    def reference_add_popolare():
+        fresh = VoteAggregates()
+        for artist_key, users in votes_popolare.items():
+            for user_id, score in users.items():
+                fresh.add_popolare(artist_key, user_id, score)
+
+    def matrix_ranking():
+        # simula un nuovo voto: medie ricalcolate in blocco
+        matrix.version += 1
+        return matrix.ranking(artists)
+
+    def matrix_ranking_trimmed():
+        # formula più costosa: ordinamento per artista e normalizzazione per giudice
+        trimmed.version += 1
+        return trimmed.ranking(artists)
+
+    return {
+        "matrix_add_popolare": matrix_add_popolare,
+        "matrix_add_tecnica": matrix_add_tecnica,
+        # caricamento dei voti all'avvio e dopo sync_shared_votes
+        "matrix_rebuild": lambda: VoteMatrix.from_votes(main.TECHNICAL_AMBITI, votes_popolare, votes_tecnica),
+        "matrix_ranking": matrix_ranking,
+        "matrix_ranking_trimmed": matrix_ranking_trimmed,
+        "render_ranking": lambda: render_ranking("*Classifica*", ranking, artists),
+        "standings_cached": lambda: standings.get("*Classifica*", artists),
+        # aggregati su dict (bench/aggregates.py), solo come riferimento
+        "reference_aggregates_rebuild": lambda: VoteAggregates.from_votes(votes_popolare, votes_tecnica),
+        "reference_aggregates_add_popolare": reference_add_popolare,
+        "reference_ranking": lambda: aggregates.ranking(artists),
+        # 1000 URL per chiamata
+        "public_id_from_url": lambda: [main.get_public_id_from_url(url) for url in urls],
+        "welcome_texts": lambda: (welcome_text(update), get_benvenuto_popolare_text(update),
+                                  get_benvenuto_tecnica_text(update), get_benvenuto_prop_text(update)),
+        **{f"update_decode_{name}": (lambda c=c: c.loads(raw_update)) for name, c in codecs.items()},
+        **{f"snapshot_encode_{name}": (lambda c=c: c.dumps(snapshot)) for name, c in codecs.items()},
+    }
+
+
+# funzioni la cui dimensione non dipende dal numero di voti
+SIZE_INDEPENDENT = {"welcome_texts", "standings_cached", "public_id_from_url"} | {
+    f"update_decode_{name}" for name in codec.CODECS}
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time_us": round(best * 1e6, 3), "peak_kib": round(peak / 1024, 2)}
+
+
+def run(sizes: List[int], only: str, repeat: int) -> Dict[str, dict]:
+    results: Dict[str, dict] = {}
+    for size in sizes:
+        for name, fn in cases(size).items():
+            if only and only not in name:
+                continue
+            if name in SIZE_INDEPENDENT and size != sizes[0]:
+                continue
+            key = name if name in SIZE_INDEPENDENT else f"{name}[{size}]"
+            results[key] = measure(fn, repeat)
+            print(f"{key:<40}{results[key]['time_us']:>14.3f} us{results[key]['peak_kib']:>12.2f} KiB")
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> bool:
+    """Stampa le variazioni rispetto alla baseline; False se qualcosa peggiora oltre la soglia."""
+    ok = True
+    print(f"\n{'benchmark':<40}{'tempo':>12}{'memoria':>12}")
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<40}{'nuovo':>12}")
+            continue
+        time_delta = current["time_us"] / base["time_us"] - 1 if base["time_us"] else 0.0
+        mem_delta = current["peak_kib"] / base["peak_kib"] - 1 if base["peak_kib"] else 0.0
+        flag = ""
+        if time_delta > threshold or mem_delta > threshold:
+            flag = "  PEGGIORATO"
+            ok = False
+        print(f"{key:<40}{time_delta:>+11.1%}{mem_delta:>+12.1%}{flag}")
+    return ok
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmark del percorso dei voti")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numero di voti dei dataset")
+    parser.add_argument("--only", default="", help="esegue solo i benchmark che contengono questo testo")
+    parser.add_argument("--repeat", type=int, default=5, help="ripetizioni per misura (si tiene la migliore)")
+    parser.add_argument("--save", action="store_true", help="salva i risultati come baseline")
+    parser.add_argument("--compare", action="store_true", help="confronta con la baseline")
+    parser.add_argument("--threshold", type=float, default=0.3, help="peggioramento tollerato (0.3 = 30%%)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE, help="file della baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.only, args.repeat)
+    if args.save:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline salvata in {args.baseline}")
+    if args.compare:
+        if not args.baseline.exists():
+            print(f"Baseline {args.baseline} non trovata: eseguire prima con --save")
+            return 1
+        return 0 if compare(results, json.loads(args.baseline.read_text()), args.threshold) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
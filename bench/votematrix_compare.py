@@ -0,0 +1,163 @@
+"""Confronto memoria/tempo tra voti in dict annidati e VoteMatrix.
+
+Per ogni numero di giudici genera i voti di tutti i giudici per tutti gli
+artisti (70% giuria popolare, 30% tecnica con 4 ambiti) e misura:
+
+- memoria: picco tracemalloc per costruire la struttura;
+- tempo della classifica calcolata da zero: ciclo sui dict come nel vecchio
+  stop_voting_handler, VoteAggregates.rebuild + ranking, VoteMatrix.ranking
+  dopo un nuovo voto (le medie vengono ricalcolate in blocco).
+
+Prima del confronto verifica che VoteMatrix dia gli stessi risultati dei
+dict su più artisti della capacità iniziale, con artisti votati da una
+sola giuria.
+
+    python bench/votematrix_compare.py --judges 1000 10000 50000 --artists 30
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from artisti import ArtistStore  # noqa: E402
+from aggregates import VoteAggregates  # noqa: E402
+from votematrix import VoteMatrix  # noqa: E402
+
+AMBITI = ["Intonazione", "Interpretazione", "Tecninca Musicale/Strumentale", "Presenza Scenica"]
+
+
+def make_votes(judges: int, artists: int, seed: int = 7) -> Tuple[ArtistStore, dict, dict]:
+    rng = random.Random(seed)
+    store = ArtistStore({
+        f"artist{n}": {"nome": f"Artista {n}", "categoria": "Big" if n % 2 else "Giovani Promesse"}
+        for n in range(1, artists + 1)
+    })
+    n_tecnica = judges * 3 // 10
+    votes_popolare = {key: {} for key in store}
+    votes_tecnica = {key: {} for key in store}
+    for key in store:
+        for judge in range(judges - n_tecnica):
+            votes_popolare[key][100_000_000 + judge] = float(rng.randint(1, 10))
+        for judge in range(n_tecnica):
+            votes_tecnica[key][200_000_000 + judge] = {ambito: float(rng.randint(1, 10)) for ambito in AMBITI}
+    return store, votes_popolare, votes_tecnica
+
+
+def dict_ranking(artists: ArtistStore, votes_popolare: dict, votes_tecnica: dict) -> Dict[str, list]:
+    """Calcolo originale di stop_voting_handler: cicli Python sui dict annidati."""
+    ranking: Dict[str, list] = {}
+    for artist_key, artist in artists.items():
+        pop = list(votes_popolare.get(artist_key, {}).values())
+        pop_m = sum(pop) / len(pop) if pop else 0.0
+        ballots = [sum(a.values()) / len(a) for a in votes_tecnica.get(artist_key, {}).values() if a]
+        tech_m = sum(ballots) / len(ballots) if ballots else 0.0
+        ranking.setdefault(artist["categoria"], []).append(((pop_m + tech_m) / 2, artist_key, pop_m, tech_m))
+    for entries in ranking.values():
+        entries.sort(key=lambda x: x[0], reverse=True)
+    return ranking
+
+
+def check_against_dicts(artists: int = 40, judges: int = 12) -> None:
+    """VoteMatrix e dict devono coincidere anche oltre la capacità iniziale (16 artisti)."""
+    store, votes_popolare, votes_tecnica = make_votes(judges, artists)
+    for n, key in enumerate(store):
+        # un artista su tre solo popolare, uno su tre solo tecnico
+        if n % 3 == 1:
+            votes_tecnica[key] = {}
+        elif n % 3 == 2:
+            votes_popolare[key] = {}
+    matrix = VoteMatrix(AMBITI)
+    pop_so_far: dict = {}
+    tech_so_far: dict = {}
+    # un artista alla volta come durante la serata, con classifica e controlli dopo ognuno
+    for key in store:
+        pop_so_far[key], tech_so_far[key] = votes_popolare[key], votes_tecnica[key]
+        for user_id, score in votes_popolare[key].items():
+            matrix.add_popolare(key, user_id, score)
+        for user_id, aspects in votes_tecnica[key].items():
+            for ambito, score in aspects.items():
+                matrix.add_tecnica(key, user_id, ambito, score)
+        expected = dict_ranking(store, pop_so_far, tech_so_far)
+        got = matrix.ranking(store)
+        for categoria, entries in expected.items():
+            for want, have in zip(entries, got[categoria]):
+                assert want[1] == have[1] and abs(want[0] - have[0]) < 1e-6, (want, have)
+        for user_id in (100_000_000, 200_000_000):
+            assert matrix.has_popolare(key, user_id) == (user_id in votes_popolare[key])
+            assert matrix.has_tecnica(key, user_id, AMBITI[0]) == (user_id in votes_tecnica[key])
+            assert matrix.ballot(key, user_id) == votes_tecnica[key].get(user_id, {})
+    print(f"Verifica con {artists} artisti: VoteMatrix coincide con i dict.")
+
+
+def peak_memory(build: Callable[[], object]) -> Tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def best_time(fn: Callable[[], object], repeat: int = 5) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def compare(judges: int, artists: int) -> dict:
+    store, votes_popolare, votes_tecnica = make_votes(judges, artists)
+
+    def build_dicts():
+        # copia: stessa forma dei dict tenuti prima in bot_data
+        return ({a: dict(u) for a, u in votes_popolare.items()},
+                {a: {j: dict(b) for j, b in u.items()} for a, u in votes_tecnica.items()})
+
+    (dict_pop, dict_tech), dict_bytes = peak_memory(build_dicts)
+    matrix, matrix_bytes = peak_memory(lambda: VoteMatrix.from_votes(AMBITI, votes_popolare, votes_tecnica))
+
+    def matrix_ranking():
+        # nuovo voto: invalida le medie in cache e forza il ricalcolo
+        matrix.version += 1
+        return matrix.ranking(store)
+
+    return {
+        "judges": judges,
+        "votes": sum(map(len, votes_popolare.values())) + 4 * sum(map(len, votes_tecnica.values())),
+        "dict_mib": dict_bytes / 2 ** 20,
+        "matrix_mib": matrix_bytes / 2 ** 20,
+        "matrix_arrays_mib": matrix.nbytes / 2 ** 20,
+        "dict_ranking_ms": best_time(lambda: dict_ranking(store, dict_pop, dict_tech)) * 1000,
+        "aggregates_rebuild_ms": best_time(
+            lambda: VoteAggregates.from_votes(dict_pop, dict_tech).ranking(store), repeat=2) * 1000,
+        "matrix_ranking_ms": best_time(matrix_ranking) * 1000,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Dict annidati contro VoteMatrix")
+    parser.add_argument("--judges", type=int, nargs="+", default=[1_000, 10_000, 20_000])
+    parser.add_argument("--artists", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    check_against_dicts(max(args.artists, 40))
+    header = ("giudici", "voti", "dict MiB", "matrice MiB", "dict ms", "rebuild ms", "matrice ms")
+    print("".join(f"{h:>13}" for h in header))
+    for judges in args.judges:
+        r = compare(judges, args.artists)
+        print(f"{r['judges']:>13}{r['votes']:>13}{r['dict_mib']:>13.1f}{r['matrix_mib']:>13.1f}"
+              f"{r['dict_ranking_ms']:>13.1f}{r['aggregates_rebuild_ms']:>13.1f}{r['matrix_ranking_ms']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket asincrono: `rate` token al secondo, al massimo `capacity` accumulati."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class DeliveryResult:
+    chat_id: int
+    ok: bool = False
+    attempts: int = 0
+    error: Optional[str] = None
+    message: Any = None
+
+
+def _retry_delay(error: RetryAfter) -> float:
+    delay = error.retry_after
+    # nelle versioni recenti di PTB retry_after può essere un timedelta
+    if hasattr(delay, "total_seconds"):
+        delay = delay.total_seconds()
+    return float(delay)
+
+
+class Broadcaster:
+    """Invia lo stesso contenuto a molte chat in parallelo.
+
+    La concorrenza è limitata da un semaforo; i limiti di Telegram (circa 30
+    messaggi al secondo in totale e 1 al secondo per chat) sono rispettati
+    con un token bucket globale e uno per chat. RetryAfter viene rispettato e
+    ritentato, così come timeout ed errori di rete transitori.
+    """
+
+    def __init__(self, max_concurrency: int = 20, global_rate: float = 25, per_chat_rate: float = 1,
+                 max_attempts: int = 3):
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.per_chat_rate = per_chat_rate
+        self._global = TokenBucket(global_rate)
+        self._per_chat: Dict[int, TokenBucket] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def send(self, chat_ids: Iterable[int],
+                   send: Callable[[int], Awaitable[Any]]) -> Dict[int, DeliveryResult]:
+        """Chiama `send(chat_id)` per ogni chat e restituisce l'esito per destinatario."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        chat_ids = list(dict.fromkeys(chat_ids))
+        results = await asyncio.gather(*(self._deliver(chat_id, send) for chat_id in chat_ids))
+        return {result.chat_id: result for result in results}
+
+    async def _deliver(self, chat_id: int, send: Callable[[int], Awaitable[Any]]) -> DeliveryResult:
+        result = DeliveryResult(chat_id=chat_id)
+        bucket = self._per_chat.get(chat_id)
+        if bucket is None:
+            bucket = self._per_chat[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        async with self._semaphore:
+            while result.attempts < self.max_attempts:
+                result.attempts += 1
+                await bucket.acquire()
+                await self._global.acquire()
+                try:
+                    result.message = await send(chat_id)
+                    result.ok = True
+                    result.error = None
+                    return result
+                except RetryAfter as e:
+                    result.error = str(e)
+                    await asyncio.sleep(_retry_delay(e))
+                except BadRequest as e:
+                    # errore nel contenuto (es. MarkdownV2 non valido): inutile ritentare
+                    result.error = str(e)
+                    break
+                except NetworkError as e:
+                    result.error = str(e)
+                    await asyncio.sleep(0.5 * result.attempts)
+                except Exception as e:
+                    result.error = str(e)
+                    break
+        # campionato: con molti giudici irraggiungibili l'errore si ripete per ogni destinatario
+        logger.error("Invio alla chat %s fallito dopo %s tentativi: %s", chat_id, result.attempts, result.error,
+                     extra={"sample": True})
+        return result
@@ -0,0 +1,49 @@
+from typing import Dict, Optional, Tuple
+
+from telegram.helpers import escape_markdown
+
+from votematrix import VoteMatrix
+
+
+def render_ranking(title: str, ranking: Dict[str, list], artists: Dict[str, dict]) -> str:
+    """Testo MarkdownV2 della classifica prodotta da VoteMatrix.ranking."""
+    parts = [title]
+    for categoria, entries in ranking.items():
+        if not entries:
+            continue
+        cat_esc = escape_markdown(categoria, version=2)
+        parts.append(f"\n*Categoria: {cat_esc}*")
+        for overall, artist_key, pop_m, tech_m in entries:
+            nome = escape_markdown(artists[artist_key].get("nome", ""), version=2)
+            overall_str = escape_markdown(f"{overall:.2f}", version=2)
+            pop_str = escape_markdown(f"{pop_m:.2f}", version=2)
+            tech_str = escape_markdown(f"{tech_m:.2f}", version=2)
+            parts.append(
+                f"*{nome}: {overall_str}*\n"
+                f"\\- Popolare: {pop_str}\n"
+                f"\\- Tecnica: {tech_str}\n"
+            )
+    return "\n".join(parts)
+
+
+class StandingsCache:
+    """Classifica già renderizzata, ricalcolata solo quando arriva un voto.
+
+    Il testo viene riutilizzato finché `votes.version` non cambia;
+    le modifiche agli artisti devono chiamare `invalidate()`.
+    """
+
+    def __init__(self, votes: VoteMatrix):
+        self.votes = votes
+        self._rendered: Dict[str, Tuple[int, str]] = {}
+
+    def get(self, title: str, artists: Dict[str, dict]) -> str:
+        cached: Optional[Tuple[int, str]] = self._rendered.get(title)
+        if cached is not None and cached[0] == self.votes.version:
+            return cached[1]
+        text = render_ranking(title, self.votes.ranking(artists), artists)
+        self._rendered[title] = (self.votes.version, text)
+        return text
+
+    def invalidate(self) -> None:
+        self._rendered.clear()
@@ -0,0 +1,117 @@
+import json
+import logging
+from typing import Any, Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # opzionale: pip install orjson
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # opzionale: pip install msgspec
+    msgspec = None
+
+
+class Codec:
+    """Coppia loads/dumps JSON; dumps restituisce sempre bytes UTF-8 compatti.
+
+    Le chiavi non stringa (es. gli id dei giudici nelle viste dei voti)
+    diventano stringhe come con il modulo json; `default` converte gli
+    oggetti non serializzabili.
+    """
+
+    def __init__(self, name: str, loads: Callable[[Union[bytes, str]], Any],
+                 dumps: Callable[[Any, Optional[Callable[[Any], Any]]], bytes]):
+        self.name = name
+        self.loads = loads
+        self._dumps = dumps
+
+    def dumps(self, obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        return self._dumps(obj, default)
+
+    def dumps_str(self, obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+        return self._dumps(obj, default).decode("utf-8")
+
+    def __repr__(self) -> str:
+        return f"Codec({self.name})"
+
+
+def _stdlib() -> Codec:
+    def dumps(obj, default=None):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default).encode("utf-8")
+
+    return Codec("json", json.loads, dumps)
+
+
+def _orjson() -> Codec:
+    def dumps(obj, default=None):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    return Codec("orjson", orjson.loads, dumps)
+
+
+def _msgspec() -> Codec:
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+
+    def loads(data):
+        # stesso tipo di eccezione di json e orjson (sottoclassi di ValueError)
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    def dumps(obj, default=None):
+        if default is None:
+            return encoder.encode(obj)
+        return msgspec.json.encode(obj, enc_hook=default)
+
+    return Codec("msgspec", loads, dumps)
+
+
+# ordine di preferenza misurato con bench/micro.py (update_decode_*, snapshot_encode_*)
+CODECS = {"msgspec": _msgspec, "orjson": _orjson, "json": _stdlib}
+
+
+def available() -> list:
+    """Codec utilizzabili in questo ambiente, dal più veloce."""
+    installed = {"msgspec": msgspec is not None, "orjson": orjson is not None, "json": True}
+    return [name for name in CODECS if installed[name]]
+
+
+def get_codec(name: str = "auto") -> Codec:
+    """Codec richiesto; "auto" sceglie il primo disponibile tra msgspec, orjson e json."""
+    name = (name or "auto").lower()
+    if name == "auto":
+        name = available()[0]
+    elif name not in CODECS:
+        raise ValueError(f"Codec JSON sconosciuto: {name} (disponibili: {', '.join(CODECS)})")
+    elif name not in available():
+        logger.warning("Codec JSON %s non installato, uso json della libreria standard.", name)
+        name = "json"
+    return CODECS[name]()
+
+
+# codec usato da webhook, registro dei voti e log JSON; main.py lo imposta da JSON_CODEC
+codec = get_codec()
+
+
+def set_codec(name: str) -> Codec:
+    global codec
+    codec = get_codec(name)
+    return codec
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return codec.loads(data)
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    return codec.dumps(obj, default)
+
+
+def dumps_str(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    return codec.dumps_str(obj, default)
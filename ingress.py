@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update) -> int:
+    """Chiave usata per mantenere l'ordine degli update della stessa chat."""
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return user.id
+    return getattr(update, "update_id", 0)
+
+
+# tipi di update gestiti dagli handler (comandi, testo, foto, pulsanti inline):
+# dichiarati in set_webhook, così Telegram non invia gli altri
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+
+def skip_reason(data: dict, private_only: bool = True) -> Optional[str]:
+    """Motivo per scartare un update dal JSON grezzo, prima di Update.de_json; None se va elaborato.
+
+    - "type": tipo non dichiarato in ALLOWED_UPDATES (es. webhook registrato
+      prima di allowed_updates);
+    - "chat": messaggio da un gruppo o canale con `private_only`;
+    - "content": messaggio senza testo né foto (sticker, vocali, servizio...),
+      che nessun handler gestisce.
+    """
+    message = data.get("message")
+    if message is None:
+        callback = data.get("callback_query")
+        if callback is None:
+            return "type"
+        message = callback.get("message") or {}
+        if private_only and message.get("chat", {}).get("type", "private") != "private":
+            return "chat"
+        return None
+    if private_only and message.get("chat", {}).get("type") != "private":
+        return "chat"
+    if "text" not in message and "photo" not in message:
+        return "content"
+    return None
+
+
+class RecentUpdates:
+    """update_id visti di recente, per scartare gli update che Telegram riconsegna.
+
+    LRU limitato a `max_size` id; un id più vecchio di `ttl` secondi non
+    conta più come duplicato (Telegram smette di riconsegnare molto prima).
+    Il controllo avviene sul JSON grezzo, prima di Update.de_json; l'id
+    viene registrato solo quando l'update è in coda, così un update
+    rifiutato (400/503) può essere riconsegnato ed elaborato.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.skipped = 0
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    def seen(self, update_id: int) -> bool:
+        """True (e conta lo scarto) se l'update è già stato accettato entro `ttl` secondi."""
+        seen_at = self._seen.get(update_id)
+        if seen_at is None or time.monotonic() - seen_at >= self.ttl:
+            return False
+        self._seen.move_to_end(update_id)
+        self.skipped += 1
+        return True
+
+    def add(self, update_id: int) -> None:
+        """Registra un update accettato; da chiamare solo dopo averlo messo in coda."""
+        self._seen[update_id] = time.monotonic()
+        self._seen.move_to_end(update_id)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class UpdateQueue:
+    """Coda limitata di update del webhook, elaborati da un pool di worker.
+
+    Ogni chat viene assegnata sempre allo stesso worker, così gli update di
+    una chat restano in ordine mentre chat diverse procedono in parallelo.
+    La rotta HTTP può quindi rispondere 200 a Telegram appena l'update è
+    in coda.
+    """
+
+    def __init__(self, process: Callable[[Any], Awaitable[Any]], workers: int = 8, max_size: int = 1000):
+        self.process = process
+        self.workers = workers
+        self.max_size = max_size
+        self.processed = 0
+        self.rejected = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        per_worker = max(1, self.max_size // self.workers)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+
+    def put(self, update) -> bool:
+        """Accoda l'update; restituisce False se la coda del worker è piena."""
+        queue = self._queues[chat_key(update) % self.workers]
+        try:
+            queue.put_nowait((time.monotonic(), update))
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def oldest_lag(self) -> float:
+        """Da quanto aspetta l'update più vecchio ancora in coda."""
+        now = time.monotonic()
+        oldest: Optional[float] = None
+        for queue in self._queues:
+            if not queue.empty():
+                enqueued_at = queue._queue[0][0]
+                oldest = enqueued_at if oldest is None else min(oldest, enqueued_at)
+        return now - oldest if oldest is not None else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "workers": self.workers,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "last_lag_s": round(self.last_lag, 4),
+            "max_lag_s": round(self.max_lag, 4),
+            "oldest_lag_s": round(self.oldest_lag(), 4),
+        }
+
+    async def stop(self, drain: bool = True) -> None:
+        """Ferma i worker, dopo aver elaborato gli update ancora in coda se `drain`."""
+        if drain:
+            for queue in self._queues:
+                await queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            enqueued_at, update = await queue.get()
+            lag = time.monotonic() - enqueued_at
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            try:
+                await self.process(update)
+            except Exception as e:
+                logger.error("Errore nell'elaborazione dell'update %s: %s", getattr(update, "update_id", "?"), e,
+                             extra={"sample": True})
+            finally:
+                self.processed += 1
+                queue.task_done()
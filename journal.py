@@ -0,0 +1,281 @@
+import logging
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import codec
+
+logger = logging.getLogger(__name__)
+
+# artista (N di artist<N>), giudice, giuria, ambito, voto, timestamp: 26 byte
+RECORD = struct.Struct("<IqBBfd")
+JURY_POPOLARE = 0
+JURY_TECNICA = 1
+NO_AMBITO = 255
+
+_KEY_RE = re.compile(r"^artist(\d+)$")
+
+
+@dataclass
+class VoteRecord:
+    artist_key: str
+    judge_id: int
+    jury_type: str
+    ambito: Optional[str]
+    score: float
+    timestamp: float
+
+
+class VoteJournal:
+    """Registro append-only dei voti su file, con snapshot periodici.
+
+    Ogni voto è un record binario di dimensione fissa aggiunto in coda al
+    file (O(1)): dopo un crash si riparte dall'ultimo
+    voto scritto, anche se il buffer verso Firebase non era ancora stato
+    svuotato. Ogni `snapshot_every` voti la vista annidata
+    (votes_popolare/votes_tecnica) viene salvata in `<path>.snapshot`
+    insieme alla posizione nel file, così replay() legge solo la coda.
+
+    Il reset delle votazioni non cancella il registro: lo archivia con un
+    suffisso di data, per poter ricontrollare risultati contestati.
+
+    Scritture, fsync e snapshot avvengono in un thread dedicato: gli
+    append mettono solo il record in coda, così la latenza degli handler
+    non dipende dal disco. Il thread scrive insieme tutti i record in coda
+    (un solo fsync per gruppo) e tiene la propria vista dei voti, sempre
+    coerente con la posizione nel file al momento dello snapshot.
+    """
+
+    def __init__(self, path: str, ambiti: List[str], snapshot_every: int = 500, fsync: bool = False):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.ambiti = list(ambiti)
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.appended = 0
+        self._file = None
+        self._since_snapshot = 0
+        # vista annidata usata per gli snapshot: dopo replay() la modifica solo il thread di scrittura
+        self._votes_popolare: Dict[str, dict] = {}
+        self._votes_tecnica: Dict[str, dict] = {}
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+
+    def replay(self) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+        """Ricostruisce votes_popolare e votes_tecnica da snapshot + coda del registro."""
+        votes_popolare: Dict[str, dict] = {}
+        votes_tecnica: Dict[str, dict] = {}
+        offset = 0
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "rb") as f:
+                    snapshot = codec.loads(f.read())
+                votes_popolare = {
+                    artist: {int(user): score for user, score in users.items()}
+                    for artist, users in snapshot["votes_popolare"].items()
+                }
+                votes_tecnica = {
+                    artist: {int(user): aspects for user, aspects in users.items()}
+                    for artist, users in snapshot["votes_tecnica"].items()
+                }
+                offset = snapshot["offset"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Snapshot dei voti non leggibile, replay dell'intero registro: %s", e)
+                votes_popolare, votes_tecnica, offset = {}, {}, 0
+        replayed = 0
+        for record in self.records(offset):
+            self._apply(votes_popolare, votes_tecnica, record)
+            replayed += 1
+        # copia per il thread di scrittura: il chiamante può usare liberamente i dict restituiti
+        self._votes_popolare = {artist: dict(users) for artist, users in votes_popolare.items()}
+        self._votes_tecnica = {
+            artist: {user: dict(aspects) for user, aspects in users.items()}
+            for artist, users in votes_tecnica.items()
+        }
+        self._since_snapshot = replayed
+        logger.info("Registro dei voti: %d voti riletti dopo lo snapshot.", replayed)
+        return votes_popolare, votes_tecnica
+
+    def records(self, offset: int = 0) -> Iterator[VoteRecord]:
+        """Record del file a partire da `offset`; un record incompleto in coda viene ignorato."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(RECORD.size)
+                if len(chunk) < RECORD.size:
+                    return
+                yield self._decode(chunk)
+
+    def append_popolare(self, artist_key: str, judge_id: int, score: float) -> None:
+        self._submit(artist_key, judge_id, JURY_POPOLARE, NO_AMBITO, score)
+
+    def append_tecnica(self, artist_key: str, judge_id: int, ambito: str, score: float) -> None:
+        if ambito not in self.ambiti:
+            logger.error("Registro dei voti: ambito %s sconosciuto, voto non registrato.", ambito, extra={"sample": True})
+            return
+        self._submit(artist_key, judge_id, JURY_TECNICA, self.ambiti.index(ambito), score)
+
+    def reset(self) -> None:
+        """Archivia registro e snapshot correnti e ricomincia da zero (dopo i record già in coda)."""
+        self._start_writer()
+        self._queue.put(("reset",))
+
+    def snapshot(self) -> None:
+        """Chiede al thread di scrittura uno snapshot dopo i record già in coda."""
+        self._start_writer()
+        self._queue.put(("snapshot",))
+
+    def close(self, snapshot: bool = True) -> None:
+        """Scrive i record in coda, salva lo snapshot (se `snapshot`) e ferma il thread."""
+        if self._writer is not None:
+            self._queue.put(("close", snapshot))
+            self._writer.join()
+            self._writer = None
+        else:
+            self._close(snapshot)
+
+    def _submit(self, artist_key: str, judge_id: int, jury: int, ambito: int, score: float) -> None:
+        match = _KEY_RE.match(artist_key)
+        if match is None:
+            # il voto è già salvato: il registro lo salta invece di far fallire l'handler
+            logger.error("Registro dei voti: chiave artista %s non valida, voto non registrato.", artist_key,
+                         extra={"sample": True})
+            return
+        self._start_writer()
+        self._queue.put(("record", RECORD.pack(int(match.group(1)), judge_id, jury, ambito, score, time.time())))
+        self.appended += 1
+
+    def _start_writer(self) -> None:
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run_writer, name="vote-journal", daemon=True)
+            self._writer.start()
+
+    # --- thread di scrittura ---
+
+    def _run_writer(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # tutto ciò che è già in coda viene scritto insieme
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = []
+            for item in batch:
+                if item[0] == "record":
+                    records.append(item[1])
+                    continue
+                self._write_records(records)
+                records = []
+                try:
+                    if item[0] == "snapshot":
+                        self._snapshot()
+                    elif item[0] == "reset":
+                        self._reset()
+                    elif item[0] == "close":
+                        self._close(item[1])
+                        return
+                except OSError as e:
+                    logger.error("Registro dei voti: errore in %s: %s", item[0], e)
+            self._write_records(records)
+
+    def _write_records(self, records: List[bytes]) -> None:
+        if not records:
+            return
+        try:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, "ab", buffering=0)
+                self._truncate_partial()
+            self._file.write(b"".join(records))
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            logger.error("Registro dei voti: %d voti non scritti: %s", len(records), e, extra={"sample": True})
+            return
+        for chunk in records:
+            self._apply(self._votes_popolare, self._votes_tecnica, self._decode(chunk))
+        self._since_snapshot += len(records)
+        # dopo aver aggiornato la vista, così lo snapshot include l'ultimo voto scritto
+        if self._since_snapshot >= self.snapshot_every:
+            try:
+                self._snapshot()
+            except OSError as e:
+                logger.error("Registro dei voti: snapshot non salvato: %s", e)
+
+    def _snapshot(self) -> None:
+        """Salva la vista annidata corrente e la posizione del registro (scrittura atomica)."""
+        offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        offset -= offset % RECORD.size
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(codec.dumps({
+                "offset": offset,
+                "votes_popolare": self._votes_popolare,
+                "votes_tecnica": self._votes_tecnica,
+            }))
+        os.replace(tmp_path, self.snapshot_path)
+        self._since_snapshot = 0
+
+    def _reset(self) -> None:
+        self._close(snapshot=False)
+        suffix = time.strftime("%Y%m%d-%H%M%S")
+        for path in (self.path, self.snapshot_path):
+            if os.path.exists(path):
+                os.replace(path, f"{path}.{suffix}")
+        self._votes_popolare, self._votes_tecnica = {}, {}
+        self._since_snapshot = 0
+
+    def _close(self, snapshot: bool) -> None:
+        if snapshot and (self._file is not None or self._since_snapshot):
+            self._snapshot()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _truncate_partial(self) -> None:
+        # un record scritto a metà (crash durante la write) sposterebbe tutti i successivi
+        size = os.path.getsize(self.path)
+        if size % RECORD.size:
+            logger.warning("Registro dei voti: scartati %d byte di un record incompleto.", size % RECORD.size)
+            self._file.truncate(size - size % RECORD.size)
+
+    def _decode(self, chunk: bytes) -> VoteRecord:
+        artist, judge_id, jury, ambito, score, timestamp = RECORD.unpack(chunk)
+        return VoteRecord(
+            artist_key=f"artist{artist}",
+            judge_id=judge_id,
+            jury_type="popolare" if jury == JURY_POPOLARE else "tecnica",
+            ambito=None if ambito == NO_AMBITO else self.ambiti[ambito],
+            # float32 su disco: i voti sono interi o con pochi decimali
+            score=round(score, 4),
+            timestamp=timestamp,
+        )
+
+    @staticmethod
+    def _apply(votes_popolare: dict, votes_tecnica: dict, record: VoteRecord) -> None:
+        if record.jury_type == "popolare":
+            votes_popolare.setdefault(record.artist_key, {})[record.judge_id] = record.score
+        else:
+            votes_tecnica.setdefault(record.artist_key, {}).setdefault(record.judge_id, {})[record.ambito] = record.score
+
+
+if __name__ == "__main__":
+    # Stampa il registro in CSV per verificare i voti: python journal.py data/votes.journal
+    from ambiti import TECHNICAL_AMBITI
+
+    print("timestamp,artista,giudice,giuria,ambito,voto")
+    for vote in VoteJournal(sys.argv[1], TECHNICAL_AMBITI).records():
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(vote.timestamp))
+        print(f"{when},{vote.artist_key},{vote.judge_id},{vote.jury_type},{vote.ambito or ''},{vote.score}")
@@ -0,0 +1,143 @@
+import atexit
+import contextlib
+import contextvars
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import codec
+
+# update in elaborazione nel task corrente, aggiunto a ogni record
+_update_context: contextvars.ContextVar[Tuple[Optional[int], Optional[int]]] = contextvars.ContextVar(
+    "update_context", default=(None, None)
+)
+
+# librerie che a livello INFO loggano ogni richiesta (l'URL della Bot API contiene il token)
+NOISY_LOGGERS = ("httpx", "httpcore", "aiohttp.access")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@contextlib.contextmanager
+def log_context(update_id: Optional[int], chat_id: Optional[int]):
+    """Associa update_id e chat_id ai log emessi dentro il blocco (anche dai task figli)."""
+    token = _update_context.set((update_id, chat_id))
+    try:
+        yield
+    finally:
+        _update_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id, record.chat_id = _update_context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Limita i record marcati con `extra={"sample": True}`.
+
+    Per ogni coppia (logger, messaggio non formattato) lascia passare al
+    massimo `burst` record ogni `interval` secondi; il primo record della
+    finestra successiva riporta quanti ne sono stati scartati. Serve per gli
+    errori ripetuti per destinatario (es. giudici che hanno bloccato il bot).
+    """
+
+    def __init__(self, burst: int = 5, interval: float = 60):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows: Dict[Tuple[str, object], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sample", False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in ("update_id", "chat_id", "suppressed"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return codec.dumps_str(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "update_id", None) is not None:
+            text += f" [update={record.update_id} chat={record.chat_id}]"
+        if getattr(record, "suppressed", None):
+            text += f" ({record.suppressed} messaggi simili scartati)"
+        return text
+
+
+def setup_logging(level: str = "INFO", json_format: bool = False, debug: bool = False,
+                  sample_burst: int = 5, sample_interval: float = 60) -> None:
+    """Configura il logging: l'I/O avviene in un thread dedicato tramite QueueListener.
+
+    Gli handler mettono solo il record in coda; formattazione e scrittura su
+    stderr avvengono fuori dall'event loop. Con `debug` ogni update viene
+    tracciato a livello DEBUG.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if json_format else TextFormatter())
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # i filtri girano prima della coda: il contesto dell'update è quello del task
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(sample_burst, sample_interval))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(logging.DEBUG if debug else level.upper())
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    if debug:
+        # traccia dei nostri moduli, non delle librerie
+        logging.getLogger("telegram").setLevel(logging.INFO)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Scrive i record ancora in coda e ferma il thread del listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,46 +1,63 @@
-import logging
+import hashlib
+import hmac
 import json
+import logging
 import os
+import socket
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, CallbackQueryHandler, ContextTypes, filters
 from telegram.constants import ParseMode
 from telegram.helpers import escape_markdown
+from telegram.error import BadRequest
 from text import get_benvenuto_popolare_text, get_benvenuto_tecnica_text, get_benvenuto_prop_text, welcome_text
-from profili import artists
+from profili import artists as initial_artists
+from ambiti import TECHNICAL_AMBITI
+from artisti import ArtistStore, KeyboardCache
 import asyncio
 from dotenv import load_dotenv
 from aiohttp import web
-import cloudinary
-import cloudinary.uploader
-import firebase_admin
-from firebase_admin import credentials, db
-from typing import Dict, List, Tuple
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from storage import BotDataStore
+from broadcast import Broadcaster
+from media import FileIdCache, MediaUploader
+from notifications import OwnerNotifier
+from classifica import StandingsCache
+from votematrix import VoteMatrix
+from scoring import METHODS, ScoringConfig, ScoringEngine
+from ingress import ALLOWED_UPDATES, RecentUpdates, UpdateQueue, chat_key, skip_reason
+from persistence import StorePersistence
+from journal import VoteJournal
+from shared import JUDGE_LIMIT, FirebaseSharedState, MemorySharedState
+from metrics import DUPLICATE_UPDATES, FILTERED_UPDATES, HANDLER_SECONDS, JUDGES, QUEUE_DEPTH, QUEUE_LAG, REGISTRY, VOTES, TimedRequest, instrument_handlers, metrics_middleware
+from logs import log_context, setup_logging
+import codec
+from typing import Dict, Optional
+
+load_dotenv()
+# LOG_FORMAT=json per record strutturati, LOG_DEBUG=1 per tracciare ogni update
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    json_format=os.getenv("LOG_FORMAT", "text").lower() == "json",
+    debug=os.getenv("LOG_DEBUG", "0") == "1",
 )
 logger = logging.getLogger(__name__)
+# JSON_CODEC=auto|orjson|msgspec|json: codec per webhook, registro dei voti e log JSON
+codec.set_codec(os.getenv("JSON_CODEC", "auto"))
 
-load_dotenv()
 PORT = int(os.getenv('PORT', 8443))
 TOKEN = os.getenv("TOKEN")
-WEBHOOK_URL = os.environ["WEBHOOK_URL"].rstrip("/")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
 WEBHOOK_PATH = f"/{TOKEN}"
 FULL_WEBHOOK = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
-
-# Aggiungi debug logging per verificare la configurazione
-logger.info(f"TOKEN: {TOKEN[:10]}...")  # Mostra solo i primi 10 caratteri per sicurezza
-logger.info(f"WEBHOOK_URL: {WEBHOOK_URL}")
-logger.info(f"WEBHOOK_PATH: {WEBHOOK_PATH}")
-logger.info(f"FULL_WEBHOOK: {FULL_WEBHOOK}")
-
-# Cloudinary Configuration
-cloudinary.config(
-  cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
-  api_key = os.getenv("CLOUDINARY_API_KEY"),
-  api_secret = os.getenv("CLOUDINARY_API_SECRET")
-)
+# Telegram invia WEBHOOK_SECRET nell'header X-Telegram-Bot-Api-Secret-Token; di default è
+# ricavato dal token, così resta uguale tra riavvii e repliche senza altra configurazione
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{TOKEN}".encode()).hexdigest()
+# connessioni HTTPS parallele di Telegram verso il webhook (1-100, default di Telegram 40)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+# messaggi da gruppi e canali scartati senza elaborarli (PRIVATE_CHATS_ONLY=0 per accettarli)
+PRIVATE_CHATS_ONLY = os.getenv("PRIVATE_CHATS_ONLY", "1") == "1"
+# Bot API alternativa (server locale o finto server di bench/loadtest.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
 
 # Stati della ConversationHandler
 # Stati principali
@@ -67,13 +84,104 @@ PASSWORD_POPOLARE = "1234"
 PASSWORD_TECNICA = "5678"
 PASSWORD_OWNER = "9999"
 
-TECHNICAL_AMBITI = ["Intonazione", "Interpretazione", "Tecninca Musicale/Strumentale", "Presenza Scenica"]
+# Scritture su Firebase in background, raggruppate ogni FIREBASE_FLUSH_MS o FIREBASE_FLUSH_BATCH modifiche.
+# Firebase viene inizializzato al primo accesso, non all'import.
+store = BotDataStore(
+    'bot_data',
+    flush_interval=int(os.getenv("FIREBASE_FLUSH_MS", 200)) / 1000,
+    max_batch=int(os.getenv("FIREBASE_FLUSH_BATCH", 50)),
+    credentials_path=os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
+    database_url=os.getenv("FIREBASE_DATABASE_URL"),
+)
+# user_data e stati delle conversazioni, per sopravvivere a un riavvio
+session_store = BotDataStore(
+    'sessions',
+    flush_interval=int(os.getenv("FIREBASE_FLUSH_MS", 200)) / 1000,
+    max_batch=int(os.getenv("FIREBASE_FLUSH_BATCH", 50)),
+    credentials_path=os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
+    database_url=os.getenv("FIREBASE_DATABASE_URL"),
+)
+
+# Modalità multi-replica (SHARED_STATE=firebase): voti, giudici e artista selezionato
+# passano da operazioni atomiche sul backend condiviso. "memory" usa un dict locale.
+shared = {
+    "firebase": lambda: FirebaseSharedState(store, workers=int(os.getenv("SHARED_STATE_WORKERS", 16))),
+    "memory": MemorySharedState,
+}.get(os.getenv("SHARED_STATE", "").lower(), lambda: None)()
+
+# Una sola replica alla volta riceve gli update. Stati delle conversazioni, user_data dei
+# giudici, proprietari, limiti e password restano in memoria, e Telegram invia tutti gli
+# update allo stesso URL: un bilanciatore non può instradarli per chat. Con SHARED_STATE la
+# replica che detiene ingress_lease accetta il webhook e risponde OK all'health-check; le altre
+# restano in standby (503) e caricano i dati solo quando ottengono il lease, cioè quando la
+# replica attiva si ferma o non lo rinnova entro INGRESS_LEASE_SECONDS. Il bilanciatore deve
+# usare l'health-check su "/" per mandare il traffico solo alla replica attiva.
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}"
+INGRESS_LEASE_SECONDS = float(os.getenv("INGRESS_LEASE_SECONDS", 15))
+
+# update_id già ricevuti: le riconsegne di Telegram vengono confermate con 200 e scartate.
+# Con UPDATE_DEDUP_SHARED=1 (e SHARED_STATE) ogni update viene anche registrato in
+# updates_seen/<gruppo>, così il controllo vale anche dopo un riavvio e tra repliche
+# diverse; restano solo i gruppi di UPDATE_DEDUP_SIZE update vicini a quello corrente.
+recent_updates = RecentUpdates(
+    max_size=int(os.getenv("UPDATE_DEDUP_SIZE", 10_000)),
+    ttl=float(os.getenv("UPDATE_DEDUP_TTL", 3600)),
+)
+# per quanti secondi l'artista selezionato letto dallo stato condiviso vale per i voti successivi
+SHARED_ARTIST_MAX_AGE = float(os.getenv("SHARED_ARTIST_MAX_AGE", 1))
+# idem per giudici e giurie, riletti prima di inviare il profilo di un artista
+SHARED_JUDGES_MAX_AGE = float(os.getenv("SHARED_JUDGES_MAX_AGE", 1))
+SHARED_DEDUP = shared is not None and os.getenv("UPDATE_DEDUP_SHARED", "0") == "1"
+
+# Registro append-only dei voti (VOTE_JOURNAL_PATH): recupero dopo un crash e storico per le verifiche
+journal = VoteJournal(
+    os.getenv("VOTE_JOURNAL_PATH"),
+    TECHNICAL_AMBITI,
+    snapshot_every=int(os.getenv("VOTE_JOURNAL_SNAPSHOT_EVERY", 500)),
+    fsync=os.getenv("VOTE_JOURNAL_FSYNC", "0") == "1",
+) if os.getenv("VOTE_JOURNAL_PATH") else None
+
+# Invio parallelo dei profili ai giudici nel rispetto dei limiti di Telegram
+broadcaster = Broadcaster(
+    max_concurrency=int(os.getenv("BROADCAST_CONCURRENCY", 20)),
+    global_rate=float(os.getenv("BROADCAST_RATE", 25)),
+)
 
-cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
+# URL Cloudinary -> file_id Telegram, per non far riscaricare le foto a ogni invio
+media_cache = FileIdCache()
+# Tastiere degli artisti per pagina, ricostruite solo quando cambia l'elenco
+artist_keyboards = KeyboardCache()
+# Upload/eliminazioni Cloudinary fuori dall'event loop
+uploader = MediaUploader(
+    stream=os.getenv("CLOUDINARY_STREAM_UPLOADS", "0") == "1",
+    config={
+        "cloud_name": os.getenv("CLOUDINARY_CLOUD_NAME"),
+        "api_key": os.getenv("CLOUDINARY_API_KEY"),
+        "api_secret": os.getenv("CLOUDINARY_API_SECRET"),
+    },
+)
+
+# Notifiche ai proprietari raccolte in un riepilogo ogni OWNER_DIGEST_SECONDS
+notifier = OwnerNotifier(broadcaster, interval=float(os.getenv("OWNER_DIGEST_SECONDS", 5)))
+
+# Formula della classifica: SCORING_METHOD=media|mediana|troncata, SCORING_TRIM=0.1,
+# SCORING_WEIGHTS="1,1" (popolare,tecnica), SCORING_AMBITO_WEIGHTS="2,1,1,1", SCORING_ZSCORE=1;
+# modificabile durante l'evento con /formula (salvata su Firebase)
+def scoring_from_env() -> ScoringConfig:
+    pop_weight, tech_weight = (float(w) for w in os.getenv("SCORING_WEIGHTS", "1,1").split(","))
+    ambito_weights = os.getenv("SCORING_AMBITO_WEIGHTS", "")
+    return ScoringConfig(
+        method=os.getenv("SCORING_METHOD", "media").lower(),
+        trim=float(os.getenv("SCORING_TRIM", 0.1)),
+        jury_weights={"popolare": pop_weight, "tecnica": tech_weight},
+        ambito_weights=[float(w) for w in ambito_weights.split(",")] if ambito_weights else [],
+        zscore=os.getenv("SCORING_ZSCORE", "0") == "1",
+    )
 
-firebase_admin.initialize_app(cred, {
-    'databaseURL': os.getenv("FIREBASE_DATABASE_URL")
-})
+# Voti in matrici NumPy (artista × giudice [× ambito]) con medie calcolate in blocco
+votes = VoteMatrix(TECHNICAL_AMBITI, scoring=ScoringEngine(scoring_from_env()))
+# Testo della classifica già pronto, ricalcolato solo dopo un nuovo voto
+standings = StandingsCache(votes)
 
 
 def get_public_id_from_url(url: str) -> str:
@@ -87,52 +195,256 @@ def get_public_id_from_url(url: str) -> str:
     except (ValueError, IndexError):
         return None
 
-def sanitize_votes_tecnica(votes_tecnica: dict) -> dict:
-    clean = {}
+def sanitize_ambito(ambito: str) -> str:
+    # Firebase non accetta '/' nelle chiavi
+    return ambito.replace('/', '_')
+
+def _chat_id(key):
+    # Firebase restituisce le chiavi come stringhe
+    return int(key) if isinstance(key, str) and key.lstrip('-').isdigit() else key
+
+def restore_votes(data: dict) -> None:
+    """Riporta i voti caricati da Firebase alla forma usata dagli handler:
+    id utente numerici e nomi degli ambiti originali."""
+    ambiti = {sanitize_ambito(ambito): ambito for ambito in TECHNICAL_AMBITI}
+    data["votes_popolare"] = {
+        artist_key: {_chat_id(user_id): score for user_id, score in (users or {}).items()}
+        for artist_key, users in (data.get("votes_popolare") or {}).items()
+    }
+    data["votes_tecnica"] = {
+        artist_key: {
+            _chat_id(user_id): {ambiti.get(ambito, ambito): score for ambito, score in (aspects or {}).items()}
+            for user_id, aspects in (users or {}).items()
+        }
+        for artist_key, users in (data.get("votes_tecnica") or {}).items()
+    }
+    data["judge_types"] = {_chat_id(chat_id): t for chat_id, t in (data.get("judge_types") or {}).items()}
+
+def save_bot_data_paths(changes: dict) -> None:
+    """Salva solo i percorsi modificati, es. {"votes_popolare/artist1/123": 8.0}."""
+    store.update(changes)
+
+async def save_shared_paths(changes: dict) -> None:
+    """Come save_bot_data_paths; in modalità multi-replica scrive subito anche sullo stato condiviso."""
+    save_bot_data_paths(changes)
+    if shared is not None:
+        await shared.update(changes)
+
+async def record_vote(path: str, value: float) -> bool:
+    """Salva il voto; False se per quel percorso esiste già un voto."""
+    if shared is None:
+        save_bot_data_paths({path: value})
+        return True
+    return await shared.set_if_absent(path, value)
+
+async def register_judge(context: ContextTypes.DEFAULT_TYPE, jury_type: str, chat_id: int) -> bool:
+    """Aggiunge il giudice rispettando il limite; False se il limite è raggiunto."""
+    judges = context.bot_data.setdefault(f"judges_{jury_type}", set())
+    max_limit = context.bot_data.get(f"max_judges_{jury_type}")
+    if shared is None:
+        if max_limit and len(judges) >= max_limit:
+            return False
+        judges.add(chat_id)
+        changes = {f"judges_{jury_type}": list(judges)}
+        if jury_type == "tecnica":
+            changes[f"judge_types/{chat_id}"] = "tecnica"
+        save_bot_data_paths(changes)
+    else:
+        if await shared.add_judge(jury_type, chat_id, max_limit) == JUDGE_LIMIT:
+            return False
+        judges.add(chat_id)
+        if jury_type == "tecnica":
+            # dallo stato condiviso: le altre repliche devono mandargli la scheda tecnica
+            await shared.set(f"judge_types/{chat_id}", "tecnica")
+    if jury_type == "tecnica":
+        context.bot_data.setdefault("judge_types", {})[chat_id] = "tecnica"
+    return True
+
+async def select_artist(context: ContextTypes.DEFAULT_TYPE, artist_key: str) -> None:
+    context.bot_data["current_selected_artist"] = artist_key
+    if shared is None:
+        save_bot_data_paths({"current_selected_artist": artist_key})
+    else:
+        await shared.set("current_selected_artist", artist_key)
+
+SHARED_JUDGE_KEYS = ("judges_popolare", "judges_tecnica", "judge_types")
+SHARED_VOTE_KEYS = ("votes_popolare", "votes_tecnica") + SHARED_JUDGE_KEYS
+
+async def sync_shared_judges(bot_data: dict, max_age: float = SHARED_JUDGES_MAX_AGE) -> None:
+    """In modalità multi-replica rilegge giudici e giurie, compresi quelli registrati dalle altre repliche."""
+    if shared is None:
+        return
+    popolare, tecnica, judge_types = await asyncio.gather(
+        *(shared.get_cached(key, max_age) for key in SHARED_JUDGE_KEYS)
+    )
+    bot_data["judges_popolare"] = {_chat_id(chat_id) for chat_id in popolare or []}
+    bot_data["judges_tecnica"] = {_chat_id(chat_id) for chat_id in tecnica or []}
+    bot_data["judge_types"] = {_chat_id(chat_id): t for chat_id, t in (judge_types or {}).items()}
+
+async def sync_shared_artists(bot_data: dict) -> None:
+    """In modalità multi-replica rilegge gli artisti, compresi quelli aggiunti o rimossi dalle altre repliche."""
+    if shared is None:
+        return
+    saved, next_id = await asyncio.gather(shared.get("artists"), shared.get("artists_next_id"))
+    artists: ArtistStore = bot_data["artists"]
+    if saved is not None and saved != artists.to_dict():
+        artists.replace(saved, next_id=next_id or 1)
+        standings.invalidate()
+
+# votes_version sullo stato condiviso cresce a ogni voto e a ogni reset: la matrice locale
+# viene ricostruita solo se è cambiata rispetto all'ultima lettura (o a un voto di questa replica)
+_synced_votes_version: Optional[int] = None
+# cresce all'inizio e alla fine di ogni ricostruzione: dispari = ricostruzione in corso
+_votes_generation = 0
+_votes_sync_lock = asyncio.Lock()
+
+async def bump_votes_version(generation: int) -> None:
+    """Segnala alle altre repliche un voto (o un reset) già applicato alla matrice locale.
+
+    `generation` è _votes_generation letto prima di salvare il voto: se nel
+    frattempo è partita una ricostruzione, il voto potrebbe mancare dalla
+    matrice e la versione locale non viene avanzata.
+    """
+    global _synced_votes_version
+    try:
+        version = await shared.increment("votes_version")
+    except Exception as e:
+        logger.error("Errore nell'aggiornamento di votes_version: %s", e, extra={"sample": True})
+        return
+    if generation == _votes_generation and generation % 2 == 0 and _synced_votes_version == version - 1:
+        _synced_votes_version = version
+
+async def sync_shared_votes(bot_data: dict) -> None:
+    """In modalità multi-replica rilegge dallo stato condiviso voti e giudici registrati dalle altre repliche.
+
+    I voti vengono riletti (e la matrice ricostruita) solo se votes_version è
+    cambiata: altrimenti la classifica in cache resta valida.
+    """
+    global _synced_votes_version, _votes_generation
+    if shared is None:
+        return
+    async with _votes_sync_lock:
+        version, _, _ = await asyncio.gather(
+            shared.get("votes_version"), sync_shared_judges(bot_data, 0), sync_shared_artists(bot_data),
+        )
+        version = version or 0
+        if version == _synced_votes_version:
+            return
+        _votes_generation += 1
+        try:
+            data = {}
+            data["votes_popolare"], data["votes_tecnica"] = await asyncio.gather(
+                shared.get("votes_popolare"), shared.get("votes_tecnica"),
+            )
+            restore_votes(data)
+            votes.rebuild(data["votes_popolare"], data["votes_tecnica"])
+            _synced_votes_version = version
+        finally:
+            _votes_generation += 1
+
+def recover_journal_votes(artists: ArtistStore) -> int:
+    """Aggiunge ai voti (e salva su Firebase) quelli del registro non ancora salvati."""
+    votes_popolare, votes_tecnica = journal.replay()
+    changes = {}
+    # i voti degli artisti rimossi restano nel registro ma non vengono ripristinati
+    for artist_key in [key for key in votes_popolare if key not in artists]:
+        del votes_popolare[artist_key]
+    for artist_key in [key for key in votes_tecnica if key not in artists]:
+        del votes_tecnica[artist_key]
+    for artist_key, users in votes_popolare.items():
+        for user_id, score in users.items():
+            if not votes.has_popolare(artist_key, user_id):
+                votes.add_popolare(artist_key, user_id, score)
+                changes[f"votes_popolare/{artist_key}/{user_id}"] = score
     for artist_key, users in votes_tecnica.items():
-        clean[artist_key] = {}
         for user_id, aspects in users.items():
-            clean_aspects = {
-                ambito.replace('/', '_'): score
-                for ambito, score in aspects.items()
-            }
-            clean[artist_key][user_id] = clean_aspects
-    return clean
-
-def save_bot_data(bot_data: dict) -> None:
-    data_to_save = {
-        "max_judges_popolare": bot_data.get("max_judges_popolare"),
-        "max_judges_tecnica": bot_data.get("max_judges_tecnica"),
-        "home_picture_url": bot_data.get("home_picture_url"),
-        "votes_popolare": bot_data.get("votes_popolare", {}),
-        # sanifichiamo i nomi degli ambiti tecnici
-        "votes_tecnica": sanitize_votes_tecnica(bot_data.get("votes_tecnica", {})),
-        "judges_popolare": list(bot_data.get("judges_popolare", [])),
-        "judges_tecnica": list(bot_data.get("judges_tecnica", [])),
-        "judge_types": bot_data.get("judge_types", {}),
-        "password_popolare": PASSWORD_POPOLARE,
-        "password_tecnica": PASSWORD_TECNICA,
-        "password_owner": PASSWORD_OWNER,
-        "owners_ids": list(bot_data.get("owners_ids", []))
-    }
+            for ambito, score in aspects.items():
+                if not votes.has_tecnica(artist_key, user_id, ambito):
+                    votes.add_tecnica(artist_key, user_id, ambito, score)
+                    changes[f"votes_tecnica/{artist_key}/{user_id}/{sanitize_ambito(ambito)}"] = score
+    save_bot_data_paths(changes)
+    return len(changes)
+
+_pruned_bucket: Optional[int] = None
+_prune_task: Optional[asyncio.Task] = None
+
+def _seen_bucket(update_id: int) -> int:
+    # gli update_id sono crescenti: ogni gruppo contiene UPDATE_DEDUP_SIZE update consecutivi
+    return update_id // recent_updates.max_size
+
+async def claim_update(update_id: int) -> bool:
+    """Registra l'update nello stato condiviso; False se un'altra istanza l'ha già elaborato."""
+    global _pruned_bucket, _prune_task
+    bucket = _seen_bucket(update_id)
+    if _pruned_bucket is None or bucket > _pruned_bucket:
+        # primo update dopo l'avvio o nuovo gruppo: i gruppi vecchi vengono eliminati in background
+        _pruned_bucket = bucket
+        _prune_task = asyncio.create_task(prune_seen_updates(bucket))
     try:
-        ref = db.reference('bot_data')
-        ref.set(data_to_save)
+        return await shared.set_if_absent(f"updates_seen/{bucket}/{update_id}", int(time.time()))
     except Exception as e:
-        logger.error(f"Errore nel salvataggio dei dati su Firebase: {e}")
+        # meglio un possibile doppione che un update perso
+        logger.error("Errore nel controllo dell'update %s sullo stato condiviso: %s", update_id, e,
+                     extra={"sample": True})
+        return True
+
+async def prune_seen_updates(bucket: int) -> None:
+    """Elimina da updates_seen i gruppi fuori da [bucket - 1, bucket + 1].
 
-def load_bot_data() -> dict:
+    Legge solo le chiavi dei gruppi (shallow), non gli update registrati.
+    """
     try:
-        ref = db.reference('bot_data')
-        data = ref.get()
+        keys = await shared.get_keys("updates_seen")
+        expired = {
+            f"updates_seen/{key}": None for key in keys
+            if not (key.isdigit() and bucket - 1 <= int(key) <= bucket + 1)
+        }
+        if expired:
+            await shared.update(expired)
+            logger.info("Update già elaborati: eliminati %d gruppi scaduti.", len(expired))
+    except Exception as e:
+        logger.error("Errore nella pulizia degli update già elaborati: %s", e)
+
+async def acquire_ingress_lease(aio_app: web.Application) -> None:
+    """Attende il lease dell'ingresso, poi lo rinnova in background finché la replica è attiva."""
+    waiting = False
+    while not await shared.acquire_lease("ingress_lease", REPLICA_ID, INGRESS_LEASE_SECONDS):
+        if not waiting:
+            logger.info("Replica %s in standby: un'altra replica riceve gli update.", REPLICA_ID)
+            waiting = True
+        await asyncio.sleep(INGRESS_LEASE_SECONDS / 3)
+    logger.info("Replica %s attiva: riceve gli update del webhook.", REPLICA_ID)
+    aio_app["ingress_owner"].set()
+    aio_app["lease_task"] = asyncio.create_task(renew_ingress_lease(aio_app))
+
+async def renew_ingress_lease(aio_app: web.Application) -> None:
+    while True:
+        await asyncio.sleep(INGRESS_LEASE_SECONDS / 3)
+        try:
+            renewed = await shared.acquire_lease("ingress_lease", REPLICA_ID, INGRESS_LEASE_SECONDS)
+        except Exception as e:
+            # il lease scade solo dopo INGRESS_LEASE_SECONDS: si riprova al prossimo giro
+            logger.error("Errore nel rinnovo del lease dell'ingresso: %s", e)
+            continue
+        if not renewed:
+            # un'altra replica è subentrata con dati più recenti: questa smette di ricevere update
+            logger.error("Replica %s: lease dell'ingresso perso, update rifiutati. Riavviare la replica.", REPLICA_ID)
+            aio_app["ingress_owner"].clear()
+            aio_app["ready"].clear()
+            return
+
+async def load_bot_data() -> dict:
+    try:
+        data = await store.load()
         if not data:
             return {}
         data["judges_popolare"] = set(data.get("judges_popolare", []))
         data["judges_tecnica"] = set(data.get("judges_tecnica", []))
         data["owners_ids"] = set(data.get("owners_ids", []))
+        restore_votes(data)
         return data
     except Exception as e:
-        logger.error(f"Errore nel caricamento dei dati da Firebase: {e}")
+        logger.error("Errore nel caricamento dei dati da Firebase: %s", e)
         return {}
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -149,22 +461,24 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     if home_pic_url:
         try:
-            # Prova a inviare la foto dall'URL salvato
-            await update.message.reply_photo(
-                photo=home_pic_url,
+            # Prova a inviare la foto (file_id in cache o URL salvato)
+            sent = await update.message.reply_photo(
+                photo=media_cache.get(home_pic_url),
                 caption=welcome_message_text,
                 parse_mode=ParseMode.MARKDOWN_V2
             )
+            media_cache.remember(home_pic_url, sent)
         except Exception as e:
+            media_cache.forget(home_pic_url)
             # Se l'URL non è valido o c'è un errore, invia solo il testo
-            logger.error(f"Impossibile inviare foto home dall'URL {home_pic_url}: {e}")
+            logger.error("Impossibile inviare foto home dall'URL %s: %s", home_pic_url, e)
             await update.message.reply_text(
                 text=welcome_message_text,
                 parse_mode=ParseMode.MARKDOWN_V2
             )
     else:
         # Se nessun URL è configurato, invia solo il testo
-        logger.info("Nessuna home_picture_url configurata. Invio del solo testo.")
+        logger.debug("Nessuna home_picture_url configurata. Invio del solo testo.")
         await update.message.reply_text(
             text=welcome_message_text,
             parse_mode=ParseMode.MARKDOWN_V2
@@ -179,35 +493,21 @@ async def check_password(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if user_password == PASSWORD_POPOLARE:
         context.user_data['jury_type'] = "popolare"
         context.user_data["logged_in"] = True 
-        judges_popolare = context.bot_data.setdefault("judges_popolare", set())
-        max_limit = context.bot_data.get("max_judges_popolare")
-        if max_limit and len(judges_popolare) >= max_limit:
+        if not await register_judge(context, "popolare", update.effective_chat.id):
             await update.message.reply_text("_⚠️ È stato raggiunto il limite di componenti della giuria popolare\\!_", parse_mode=ParseMode.MARKDOWN_V2)
             return ConversationHandler.END
-        judges_popolare.add(update.effective_chat.id)
-        context.bot_data["judges_popolare"] = judges_popolare
-        context.bot_data.setdefault("votes_popolare", {})
         await update.message.reply_text(get_benvenuto_popolare_text(update), parse_mode=ParseMode.MARKDOWN_V2)
         await notify_owner(update, context, "popolare")
-        save_bot_data(context.bot_data)
         return VOTE
 
     elif user_password == PASSWORD_TECNICA:
         context.user_data['jury_type'] = "tecnica"
         context.user_data["logged_in"] = True
-        judges_tecnica = context.bot_data.setdefault("judges_tecnica", set())
-        max_limit = context.bot_data.get("max_judges_tecnica")
-        if max_limit and len(judges_tecnica) >= max_limit:
+        if not await register_judge(context, "tecnica", update.effective_chat.id):
             await update.message.reply_text("_⚠️ È stato raggiunto il limite di componenti della giuria tecnica\\!_", parse_mode=ParseMode.MARKDOWN_V2)
             return ConversationHandler.END
-        judges_tecnica.add(update.effective_chat.id)
-        context.bot_data["judges_tecnica"] = judges_tecnica
-        context.bot_data.setdefault("votes_tecnica", {})
-        judge_types = context.bot_data.setdefault("judge_types", {})
-        judge_types[update.effective_chat.id] = "tecnica"
         await update.message.reply_text(get_benvenuto_tecnica_text(update), parse_mode=ParseMode.MARKDOWN_V2)
         await notify_owner(update, context, "tecnica")
-        save_bot_data(context.bot_data)
         return VOTE
 
     elif user_password == PASSWORD_OWNER:
@@ -220,7 +520,7 @@ async def check_password(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data["logged_in"] = True
         owners_ids.add(update.effective_chat.id)
         context.bot_data["owners_ids"] = owners_ids
-        save_bot_data(context.bot_data)
+        save_bot_data_paths({"owners_ids": list(owners_ids)})
         await update.message.reply_text(get_benvenuto_prop_text(update), parse_mode=ParseMode.MARKDOWN_V2)
         return MAIN_MENU
     else:
@@ -236,13 +536,8 @@ async def notify_owner(update: Update, context: ContextTypes.DEFAULT_TYPE, jury_
     escape_username = escape_markdown(user_name, version=2)
     user_id = update.effective_chat.id
     clickable_name = f"[{escape_username}](tg://user?id={user_id})"
-    text = f"_👤 Il giudice {clickable_name} si è registrato come giuria di tipo *{jury_type}*\\._"
-    
-    for owner_id in owners_ids:
-        try:
-            await context.bot.send_message(chat_id=owner_id, text=text, parse_mode=ParseMode.MARKDOWN_V2)
-        except Exception as e:
-            logger.error(f"Errore nell'invio della notifica al proprietario {owner_id}: {e}")
+    # inviata ai proprietari con il prossimo riepilogo
+    notifier.registration(clickable_name, jury_type)
 
 async def votazioni_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     owners_ids = context.bot_data.get("owners_ids", set())
@@ -252,35 +547,72 @@ async def votazioni_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await send_owner_buttons(update, context)
     return MAIN_MENU
 
-async def send_owner_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    artists_data = context.bot_data['artists']
-    buttons = []
+def page_buttons(prefix: str, page: int, pages: int) -> list:
     row = []
-    for i, (key, artist) in enumerate(artists_data.items()):
-        row.append(InlineKeyboardButton(artist['nome'], callback_data=key))
-        if len(row) == 2:
+    if page > 0:
+        row.append(InlineKeyboardButton(f"◀️ {page}/{pages}", callback_data=f"{prefix}{page - 1}"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton(f"{page + 2}/{pages} ▶️", callback_data=f"{prefix}{page + 1}"))
+    return row
+
+def owner_buttons_keyboard(artists: ArtistStore, page: int = 0) -> InlineKeyboardMarkup:
+    def build():
+        keys, current, pages = artists.page(page)
+        buttons = []
+        row = []
+        for key in keys:
+            row.append(InlineKeyboardButton(artists[key]['nome'], callback_data=key))
+            if len(row) == 2:
+                buttons.append(row)
+                row = []
+        if row:
             buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton("🛑 Interrompi votazioni", callback_data="stop_voting")])
-    reply_markup = InlineKeyboardMarkup(buttons)
+        nav = page_buttons("artists_page_", current, pages)
+        if nav:
+            buttons.append(nav)
+        buttons.append([InlineKeyboardButton("🛑 Interrompi votazioni", callback_data="stop_voting")])
+        return InlineKeyboardMarkup(buttons)
+    return artist_keyboards.get(artists, "vote", page, build)
+
+def remove_artists_keyboard(artists: ArtistStore, page: int = 0) -> InlineKeyboardMarkup:
+    def build():
+        keys, current, pages = artists.page(page)
+        keyboard = [[InlineKeyboardButton(artists[key]['nome'], callback_data=f"rm_{key}")] for key in keys]
+        nav = page_buttons("rm_page_", current, pages)
+        if nav:
+            keyboard.append(nav)
+        keyboard.append([InlineKeyboardButton("✖️ Annulla", callback_data="cancel_artists")])
+        return InlineKeyboardMarkup(keyboard)
+    return artist_keyboards.get(artists, "remove", page, build)
+
+async def send_owner_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    reply_markup = owner_buttons_keyboard(context.bot_data['artists'])
     await update.effective_message.reply_text(
         text="*Che le votazioni abbiano inizio\\!*\n\n_Premi sul nome dell'artista per il quale vuoi che venga espresso il voto della giuria\\._" ,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN_V2
     )
 
+async def artists_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    page = int(query.data.rsplit("_", 1)[1])
+    await query.edit_message_reply_markup(reply_markup=owner_buttons_keyboard(context.bot_data['artists'], page))
+
 async def owner_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     artist_key = query.data
 
     if artist_key == "stop_voting":
-        await stop_voting_handler(update, context)
+        with HANDLER_SECONDS.time(handler="stop_voting_handler"):
+            await stop_voting_handler(update, context)
         return MAIN_MENU
 
     artists = context.bot_data.get("artists", {})
+    if artist_key not in artists:
+        # aggiunto tramite un'altra replica
+        await sync_shared_artists(context.bot_data)
     if artist_key not in artists:
         await query.edit_message_text("Artista non trovato.")
         return MAIN_MENU
@@ -290,7 +622,7 @@ async def owner_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         f"*🔜 Cominciano le votazioni per {artist['nome']}*",
         parse_mode=ParseMode.MARKDOWN_V2
     )
-    context.bot_data["current_selected_artist"] = artist_key
+    await select_artist(context, artist_key)
 
     response_text = (
         f"*Nome:* {escape_markdown(artist['nome'], version=2)}\n"
@@ -298,106 +630,156 @@ async def owner_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         f"*Canzone:* {escape_markdown(artist['canzone'], version=2)}"
     )
     
+    # giudici registrati anche tramite le altre repliche, con la loro giuria
+    await sync_shared_judges(context.bot_data)
     judges = set()
     judges.update(context.bot_data.get("judges_popolare", set()))
     judges.update(context.bot_data.get("judges_tecnica", set()))
     judge_types = context.bot_data.get("judge_types", {})
 
-    for judge_chat_id in judges:
-        try:
-            prompt = "\n\n_🔽 Inserisci il tuo voto per questo artista\\:_"
-            if judge_types.get(judge_chat_id) == "tecnica":
-                prompt = f"\n\n_🔽 Esprimi il tuo voto per la categoria *{TECHNICAL_AMBITI[0]}*\\._"
+    async def send_profile(judge_chat_id):
+        prompt = "\n\n_🔽 Inserisci il tuo voto per questo artista\\:_"
+        if judge_types.get(judge_chat_id) == "tecnica":
+            prompt = f"\n\n_🔽 Esprimi il tuo voto per la categoria *{TECHNICAL_AMBITI[0]}*\\._"
 
-            if artist.get('foto'):
-                await context.bot.send_photo(
+        if artist.get('foto'):
+            photo_url = artist['foto']
+            cached = photo_url in media_cache
+            try:
+                sent = await context.bot.send_photo(
                     chat_id=judge_chat_id,
-                    photo=artist['foto'],
+                    photo=media_cache.get(photo_url),
                     caption=response_text + prompt,
                     parse_mode=ParseMode.MARKDOWN_V2
                 )
-            else:
-                await context.bot.send_message(
+            except BadRequest:
+                if not cached:
+                    raise
+                # file_id non più valido: si torna all'URL originale
+                media_cache.forget(photo_url)
+                sent = await context.bot.send_photo(
                     chat_id=judge_chat_id,
-                    text=response_text + prompt,
+                    photo=photo_url,
+                    caption=response_text + prompt,
                     parse_mode=ParseMode.MARKDOWN_V2
                 )
-        except Exception as e:
-            logger.error(f"Errore nell'invio del profilo all'utente {judge_chat_id}: {e}")
+            media_cache.remember(photo_url, sent)
+            return sent
+        return await context.bot.send_message(
+            chat_id=judge_chat_id,
+            text=response_text + prompt,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
 
+    # L'invio avviene in background: il callback del proprietario ritorna subito
+    context.application.create_task(
+        broadcast_artist_profile(query.message, artist, judges, send_profile),
+        update=update,
+    )
     return VOTE # Remain in VOTE state to receive votes
 
+async def broadcast_artist_profile(owner_message, artist: dict, judges: set, send_profile) -> None:
+    judges = list(judges)
+    results = {}
+    if artist.get('foto') and artist['foto'] not in media_cache:
+        # Primo invio della foto: si manda a un giudice per volta finché Telegram
+        # non restituisce un file_id, poi agli altri in parallelo senza ri-upload
+        while judges and artist['foto'] not in media_cache:
+            results.update(await broadcaster.send([judges.pop(0)], send_profile))
+    results.update(await broadcaster.send(judges, send_profile))
+    failed = [chat_id for chat_id, result in results.items() if not result.ok]
+    logger.info("Profilo di %s inviato a %d/%d giudici.", artist['nome'], len(results) - len(failed), len(results))
+    if failed:
+        try:
+            await owner_message.reply_text(
+                f"_⚠️ Profilo non recapitato a {len(failed)} giudici su {len(results)}\\._",
+                parse_mode=ParseMode.MARKDOWN_V2
+            )
+        except Exception as e:
+            logger.error("Errore nell'invio del riepilogo al proprietario: %s", e)
+
 async def vote_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if shared is not None:
+        # l'artista può essere stato scelto tramite un'altra replica
+        # lettura in cache: un solo round trip al secondo invece di uno per voto
+        selected = await shared.get_cached("current_selected_artist", SHARED_ARTIST_MAX_AGE)
+        if selected:
+            context.bot_data["current_selected_artist"] = selected
     if "current_selected_artist" not in context.bot_data:
         await update.message.reply_text("Nessun artista selezionato, attendi che il proprietario lo scelga.")
         return VOTE
 
     current_artist = context.bot_data["current_selected_artist"]
+    generation = _votes_generation
+    artists: ArtistStore = context.bot_data["artists"]
+    if current_artist not in artists:
+        # artista aggiunto tramite un'altra replica: il nome serve prima di salvare il voto
+        await sync_shared_artists(context.bot_data)
+    if current_artist not in artists:
+        await update.message.reply_text("Artista non trovato, attendi che il proprietario ne scelga un altro.")
+        return VOTE
+    artist_name = artists[current_artist]['nome']
     user_id = update.effective_user.id
     vote_input_str = update.message.text.strip()
     try:
         vote_value = float(vote_input_str)
     except ValueError:
+        VOTES.inc(jury=context.user_data.get('jury_type', 'popolare'), result="parse_error")
         await update.message.reply_text("❌ Inserisci un numero valido per il voto.")
         return VOTE
 
     jury_type = context.user_data.get('jury_type', 'popolare')
 
     if jury_type == "popolare":
-        votes_dict = context.bot_data.setdefault("votes_popolare", {})
-        if current_artist not in votes_dict:
-            votes_dict[current_artist] = {}
-        if user_id in votes_dict[current_artist]:
+        if votes.has_popolare(current_artist, user_id):
+            VOTES.inc(jury="popolare", result="duplicate")
             await update.message.reply_text("🔚 Hai già votato per questo artista\\!")
             return VOTE
         
         if not 1 <= vote_value <= 10:
+            VOTES.inc(jury="popolare", result="out_of_range")
             await update.message.reply_text("#️⃣ Il voto deve essere compreso tra 1 e 10\\. Riprova\\.")
             return VOTE
 
-        votes_dict[current_artist][user_id] = vote_value
+        if not await record_vote(f"votes_popolare/{current_artist}/{user_id}", vote_value):
+            VOTES.inc(jury="popolare", result="duplicate")
+            await update.message.reply_text("🔚 Hai già votato per questo artista\\!")
+            return VOTE
+
+        VOTES.inc(jury="popolare", result="accepted")
+        if journal is not None:
+            journal.append_popolare(current_artist, user_id, vote_value)
+        votes.add_popolare(current_artist, user_id, vote_value)
         await update.message.reply_text("Grazie per il tuo voto!")
         
-        owners_ids = context.bot_data.get("owners_ids", set())
-        if owners_ids:
-            user_name = update.effective_user.first_name
-            escape_username = escape_markdown(user_name, version=2)
-            clickable_name = f"[{escape_username}](tg://user?id={user_id})"
-            formatted_vote = escape_markdown(str(vote_value), version=2)
-            artist_nome = escape_markdown(context.bot_data['artists'][current_artist]['nome'], version=2)
-            notification_text = (
-                f"🔝 Il giudice {clickable_name} ha votato per l'artista {artist_nome} con voto\\: {formatted_vote}\\."
-            )
-            for owner_id in owners_ids:
-                try:
-                    await context.bot.send_message(chat_id=owner_id, text=notification_text, parse_mode=ParseMode.MARKDOWN_V2)
-                except Exception as e:
-                    logger.error(f"Errore nell'invio della notifica al proprietario {owner_id}: {e}")
-        save_bot_data(context.bot_data)
+        notifier.vote(current_artist, artist_name, "popolare")
+        if shared is not None:
+            await bump_votes_version(generation)
         return VOTE
 
     else: # Technical Jury
-        votes_dict = context.bot_data.setdefault("votes_tecnica", {})
-        if current_artist not in votes_dict:
-            votes_dict[current_artist] = {}
-        if user_id not in votes_dict[current_artist]:
-            votes_dict[current_artist][user_id] = {}
-
         ambito_index = context.user_data.get("ambito_index", 0)
         current_ambito = TECHNICAL_AMBITI[ambito_index]
 
         if not 1 <= vote_value <= 10:
+            VOTES.inc(jury="tecnica", result="out_of_range")
             await update.message.reply_text(
                 f"#️⃣ Il voto per la categoria *{current_ambito}* deve essere compreso tra 1 e 10\\. Riprova\\.",
                 parse_mode=ParseMode.MARKDOWN_V2
             )
             return VOTE
 
-        if current_ambito in votes_dict[current_artist][user_id]:
+        if votes.has_tecnica(current_artist, user_id, current_ambito) or not await record_vote(
+            f"votes_tecnica/{current_artist}/{user_id}/{sanitize_ambito(current_ambito)}", vote_value
+        ):
+            VOTES.inc(jury="tecnica", result="duplicate")
             await update.message.reply_text("🔚 Hai già votato per questo artista in questo ambito\\!")
             return VOTE
 
-        votes_dict[current_artist][user_id][current_ambito] = vote_value
+        VOTES.inc(jury="tecnica", result="accepted")
+        if journal is not None:
+            journal.append_tecnica(current_artist, user_id, current_ambito, vote_value)
+        votes.add_tecnica(current_artist, user_id, current_ambito, vote_value)
         ambito_index += 1
         context.user_data["ambito_index"] = ambito_index
 
@@ -408,7 +790,7 @@ async def vote_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
                 parse_mode=ParseMode.MARKDOWN_V2
             )
         else:
-            user_votes = votes_dict[current_artist][user_id]
+            user_votes = votes.ballot(current_artist, user_id)
             total = sum(user_votes.values())
             avg = total / len(TECHNICAL_AMBITI)
             avg2 = escape_markdown(f"{avg:.2f}", version=2)
@@ -417,72 +799,83 @@ async def vote_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
                 parse_mode=ParseMode.MARKDOWN_V2
             )
             
-            owners_ids = context.bot_data.get("owners_ids", set())
-            if owners_ids:
-                user_name = update.effective_user.first_name
-                escape_username = escape_markdown(user_name, version=2)
-                clickable_name = f"[{escape_username}](tg://user?id={user_id})"
-                artist_nome = escape_markdown(context.bot_data['artists'][current_artist]['nome'], version=2)
-                notification_text = (
-                    f"🔝 Il giudice {clickable_name} ha votato per l'artista {artist_nome}\\. Media dei voti\\: {avg2}"
-                )
-                for owner_id in owners_ids:
-                    try:
-                        await context.bot.send_message(chat_id=owner_id, text=notification_text, parse_mode=ParseMode.MARKDOWN_V2)
-                    except Exception as e:
-                        logger.error(f"Errore nell'invio della notifica al proprietario {owner_id}: {e}")
+            notifier.vote(current_artist, artist_name, "tecnica")
             context.user_data["ambito_index"] = 0 # Reset for next artist
-        
-        save_bot_data(context.bot_data)
+
+        if shared is not None:
+            await bump_votes_version(generation)
         return VOTE
 
 async def stop_voting_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await sync_shared_votes(context.bot_data)
     artists_data: Dict[str, dict] = context.bot_data.get("artists", {})
-    votes_popolare: Dict[str, Dict[int, int]] = context.bot_data.get("votes_popolare", {})
-    votes_tecnica: Dict[str, Dict[int, Dict[str, int]]] = context.bot_data.get("votes_tecnica", {})
-
-    ranking: Dict[str, List[Tuple[float, str, float, float]]] = {}
-
-    for artist_key, artist in artists_data.items():
-        categoria = artist.get("categoria", "Giovani Promesse")
+    # medie calcolate con riduzioni vettoriali sulla matrice dei voti, in cache fino al prossimo voto
+    message = standings.get("*🏆 Risultati Votazioni:*", artists_data)
 
-        pop_votes = votes_popolare.get(artist_key, {})
-        avg_pop = sum(pop_votes.values()) / len(pop_votes) if pop_votes else 0.0
+    # i risultati vengono annunciati solo dopo che tutti i voti sono su Firebase
+    # e dopo l'ultimo riepilogo dei voti
+    await store.flush()
+    await notifier.flush()
 
-        tech_votes = votes_tecnica.get(artist_key, {})
-        tech_list = [sum(aspects.values()) / len(aspects) for aspects in tech_votes.values() if aspects]
-        avg_tech = sum(tech_list) / len(tech_list) if tech_list else 0.0
+    for owner_id in context.bot_data.get("owners_ids", set()):
+        try:
+            await context.bot.send_message(chat_id=owner_id, text=message, parse_mode=ParseMode.MARKDOWN_V2)
+        except Exception as e:
+            logger.error("Errore nell'invio dei risultati al proprietario: %s", e)
 
-        overall_avg = (avg_pop + avg_tech) / 2
-        nome_esc = escape_markdown(artist.get("nome", ""), version=2)
+async def classifica_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    owners_ids = context.bot_data.get("owners_ids", set())
+    if update.effective_chat.id not in owners_ids:
+        await update.message.reply_text("Non sei autorizzato ad eseguire questo comando.")
+        return MAIN_MENU
 
-        ranking.setdefault(categoria, []).append((overall_avg, nome_esc, avg_pop, avg_tech))
+    await sync_shared_votes(context.bot_data)
+    message = standings.get("*📈 Classifica provvisoria:*", context.bot_data.get("artists", {}))
+    await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN_V2)
+    return MAIN_MENU
 
-    for entries in ranking.values():
-        entries.sort(key=lambda x: x[0], reverse=True)
+async def formula_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """/formula [media|mediana|troncata [quota]] | pesi <popolare> <tecnica> | ambiti <pesi...> | zscore on|off"""
+    owners_ids = context.bot_data.get("owners_ids", set())
+    if update.effective_chat.id not in owners_ids:
+        await update.message.reply_text("Non sei autorizzato ad eseguire questo comando.")
+        return MAIN_MENU
 
-    parts = ["*🏆 Risultati Votazioni:*"]
-    for categoria, entries in ranking.items():
-        if not entries:
-            continue
-        cat_esc = escape_markdown(categoria, version=2)
-        parts.append(f"\n*Categoria: {cat_esc}*")
-        for overall, nome, pop_m, tech_m in entries:
-            overall_str = escape_markdown(f"{overall:.2f}", version=2)
-            pop_str = escape_markdown(f"{pop_m:.2f}", version=2)
-            tech_str = escape_markdown(f"{tech_m:.2f}", version=2)
-            parts.append(
-                f"*{nome}: {overall_str}*\n"
-                f"\\- Popolare: {pop_str}\n"
-                f"\\- Tecnica: {tech_str}\n"
+    args = [arg.lower() for arg in context.args or []]
+    config = votes.scoring.config.to_dict()
+    try:
+        if not args:
+            pass
+        elif args[0] in METHODS:
+            config["method"] = args[0]
+            if len(args) > 1:
+                config["trim"] = float(args[1].rstrip("%")) / (100 if args[1].endswith("%") else 1)
+        elif args[0] == "pesi" and len(args) == 3:
+            config["jury_weights"] = {"popolare": float(args[1]), "tecnica": float(args[2])}
+        elif args[0] == "ambiti" and len(args) in (1, len(TECHNICAL_AMBITI) + 1):
+            config["ambito_weights"] = [float(w) for w in args[1:]]
+        elif args[0] == "zscore" and len(args) == 2 and args[1] in ("on", "off"):
+            config["zscore"] = args[1] == "on"
+        else:
+            raise ValueError(
+                "Uso: /formula media|mediana|troncata [quota], /formula pesi <popolare> <tecnica>, "
+                f"/formula ambiti <{len(TECHNICAL_AMBITI)} pesi>, /formula zscore on|off"
             )
-    message = "\n".join(parts)
+        new_config = ScoringConfig.from_dict(config)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return MAIN_MENU
 
-    for owner_id in context.bot_data.get("owners_ids", set()):
-        try:
-            await context.bot.send_message(chat_id=owner_id, text=message, parse_mode=ParseMode.MARKDOWN_V2)
-        except Exception as e:
-            logger.error(f"Errore nell'invio dei risultati al proprietario: {e}")
+    if args:
+        votes.set_scoring(ScoringEngine(new_config))
+        save_bot_data_paths({"scoring": new_config.to_dict()})
+        logger.info("Formula della classifica aggiornata: %s", votes.scoring.describe())
+
+    await sync_shared_votes(context.bot_data)
+    title = f"*🧮 Formula: {escape_markdown(votes.scoring.describe(), version=2)}*"
+    message = standings.get(title, context.bot_data.get("artists", {}))
+    await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN_V2)
+    return MAIN_MENU
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Operazione annullata. Usa /start per riprovare.")
@@ -498,7 +891,7 @@ async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             owners_ids.remove(update.effective_chat.id)
             context.bot_data["owners_ids"] = owners_ids
         context.user_data.pop("user_role", None)
-        save_bot_data(context.bot_data)
+        save_bot_data_paths({"owners_ids": list(owners_ids)})
     
     await update.message.reply_text("_🆓 Hai effettuato il logout\\. Usa /start per reinserire la password\\._", parse_mode=ParseMode.MARKDOWN_V2)
     return ConversationHandler.END
@@ -621,6 +1014,7 @@ async def set_value_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 context.bot_data["max_judges_popolare"] = new_limit
             elif limit_type == "tecnica":
                 context.bot_data["max_judges_tecnica"] = new_limit
+            changes = {f"max_judges_{limit_type}": new_limit}
 
             message_text = f"_✅ Limite per la giuria {limit_type} impostato a {new_limit}\\._"
             keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data="back_to_limit_menu")]]
@@ -637,13 +1031,14 @@ async def set_value_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
             PASSWORD_TECNICA = new_value
         elif pass_type == "owner":
             PASSWORD_OWNER = new_value
+        changes = {f"password_{pass_type}": new_value}
 
         message_text = f"_✅ Nuova password per {pass_type} impostata correttamente\\._"
         keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data="back_to_password_menu")]]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(message_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
-    save_bot_data(context.bot_data)  
+    save_bot_data_paths(changes)
     return SET_VALUE
 
 async def set_home_picture_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -658,7 +1053,7 @@ async def set_home_picture_handler(update: Update, context: ContextTypes.DEFAULT
 
     try:
         # Carica la nuova immagine su Cloudinary in una cartella dedicata
-        upload_result = cloudinary.uploader.upload(file.file_path, folder="home_pictures")
+        upload_result = await uploader.upload_telegram_file(file, folder="home_pictures")
         new_photo_url = upload_result.get("secure_url")
 
         if not new_photo_url:
@@ -666,18 +1061,13 @@ async def set_home_picture_handler(update: Update, context: ContextTypes.DEFAULT
 
         # Se esiste una vecchia immagine, eliminala da Cloudinary
         old_photo_url = context.bot_data.get("home_picture_url")
+        media_cache.forget(old_photo_url)
         if old_photo_url:
-            public_id = get_public_id_from_url(old_photo_url)
-            if public_id:
-                try:
-                    cloudinary.uploader.destroy(public_id)
-                    logger.info(f"Vecchia immagine home ({public_id}) eliminata da Cloudinary.")
-                except Exception as e:
-                    logger.error(f"Errore eliminazione vecchia immagine home da Cloudinary: {e}")
+            uploader.destroy_later(get_public_id_from_url(old_photo_url))
 
         # Salva il nuovo URL e aggiorna il database
         context.bot_data["home_picture_url"] = new_photo_url
-        save_bot_data(context.bot_data)
+        save_bot_data_paths({"home_picture_url": new_photo_url})
 
         await update.message.reply_text(
             "_✅ Immagine di benvenuto aggiornata con successo\\!_",
@@ -688,7 +1078,7 @@ async def set_home_picture_handler(update: Update, context: ContextTypes.DEFAULT
         return SET_OPTION
 
     except Exception as e:
-        logger.error(f"Errore durante l'upload della home picture: {e}")
+        logger.error("Errore durante l'upload della home picture: %s", e)
         await update.message.reply_text("Si è verificato un errore durante il caricamento. Riprova.")
         return SET_HOME_PICTURE
     
@@ -733,13 +1123,23 @@ async def reset_voting(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         await update.message.reply_text("Non sei autorizzato ad eseguire questo comando.")
         return MAIN_MENU
 
-    context.bot_data["votes_popolare"] = {}
-    context.bot_data["votes_tecnica"] = {}
+    generation = _votes_generation
     context.bot_data["judges_popolare"] = set()
     context.bot_data["judges_tecnica"] = set()
     context.bot_data["judge_types"] = {}
-
-    save_bot_data(context.bot_data)
+    votes.clear()
+    if journal is not None:
+        # il registro precedente resta archiviato accanto al nuovo
+        journal.reset()
+
+    # None elimina il nodo su Firebase (equivale a salvarlo vuoto)
+    cleared = {key: None for key in SHARED_VOTE_KEYS}
+    save_bot_data_paths(cleared)
+    await store.flush()
+    if shared is not None:
+        # voti e giudici registrati dalle repliche (con SHARED_STATE=memory solo lì)
+        await shared.update(cleared)
+        await bump_votes_version(generation)
     await update.message.reply_text("✅ I dati sono stati eliminati.")
     return MAIN_MENU
 
@@ -774,9 +1174,7 @@ async def artisti_choice_callback(update: Update, context: ContextTypes.DEFAULT_
             await query.edit_message_text("Non ci sono artisti da rimuovere.")
             return MAIN_MENU
 
-        keyboard = [[InlineKeyboardButton(artist['nome'], callback_data=f"rm_{key}")] for key, artist in artists.items()]
-        keyboard.append([InlineKeyboardButton("✖️ Annulla", callback_data="cancel_artists")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = remove_artists_keyboard(artists)
         await query.edit_message_text("_Seleziona l'artista da rimuovere\\:_", parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
         return ARTISTI_REMOVE
 
@@ -810,7 +1208,7 @@ async def add_artist_photo_handler(update: Update, context: ContextTypes.DEFAULT
     file = await context.bot.get_file(photo.file_id)
     
     try:
-        upload_result = cloudinary.uploader.upload(file.file_path, folder="artist_photos")
+        upload_result = await uploader.upload_telegram_file(file, folder="artist_photos")
         photo_url = upload_result.get("secure_url")
         if not photo_url:
             raise ValueError("Cloudinary did not return a secure_url")
@@ -818,7 +1216,7 @@ async def add_artist_photo_handler(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("_🎵 Inserisci il *titolo della canzone*\\._", parse_mode=ParseMode.MARKDOWN_V2)
         return ARTISTI_ADD_SONG
     except Exception as e:
-        logger.error(f"Errore durante l'upload su Cloudinary: {e}")
+        logger.error("Errore durante l'upload su Cloudinary: %s", e)
         await update.message.reply_text("Si è verificato un errore durante il caricamento dell'immagine. Riprova.")
         return ARTISTI_ADD_PHOTO
 
@@ -842,15 +1240,15 @@ async def add_artist_category_handler(update: Update, context: ContextTypes.DEFA
     categoria = " ".join(query.data.split("_")[1:])
     context.user_data["new_artist"]["categoria"] = categoria
 
-    artists = context.bot_data.get("artists", {})
-    counter = 1
-    while f"artist{counter}" in artists:
-        counter += 1
-    new_key = f"artist{counter}"
-
-    artists[new_key] = context.user_data["new_artist"]
-    context.bot_data["artists"] = artists
-    update_artists_file(artists)
+    artists: ArtistStore = context.bot_data["artists"]
+    next_id = 1
+    if shared is not None:
+        # chiave riservata sullo stato condiviso: due repliche non assegnano la stessa
+        next_id = await shared.increment("artists_next_id", artists.next_id) - 1
+    new_key = artists.add(context.user_data["new_artist"], next_id=next_id)
+    # il contatore nello stesso update: dopo un riavvio la chiave non viene riassegnata
+    await save_shared_paths({f"artists/{new_key}": dict(artists[new_key]), "artists_next_id": artists.next_id})
+    standings.invalidate()
 
     await query.edit_message_text(
         f"_✅ Artista *{escape_markdown(context.user_data['new_artist']['nome'])}* aggiunto con successo nella categoria *{escape_markdown(categoria)}*\\._",
@@ -868,6 +1266,11 @@ async def remove_artist_callback(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text("Operazione annullata.")
         return MAIN_MENU
 
+    if data.startswith("rm_page_"):
+        page = int(data.rsplit("_", 1)[1])
+        await query.edit_message_reply_markup(reply_markup=remove_artists_keyboard(context.bot_data["artists"], page))
+        return ARTISTI_REMOVE
+
     if data.startswith("rm_"):
         key = data[3:]
         artists = context.bot_data.get("artists", {})
@@ -875,62 +1278,89 @@ async def remove_artist_callback(update: Update, context: ContextTypes.DEFAULT_T
             artist_to_remove = artists[key]
             nome = artist_to_remove['nome']
             photo_url = artist_to_remove.get('foto')
+            media_cache.forget(photo_url)
 
             if photo_url:
-                public_id = get_public_id_from_url(photo_url)
-                if public_id:
-                    try:
-                        cloudinary.uploader.destroy(public_id)
-                        logger.info(f"Immagine {public_id} eliminata da Cloudinary.")
-                    except Exception as e:
-                        logger.error(f"Errore durante l'eliminazione dell'immagine {public_id} da Cloudinary: {e}")
-
-            del artists[key]
-            update_artists_file(artists)
+                uploader.destroy_later(get_public_id_from_url(photo_url))
+
+            artists.remove(key)
+            votes.remove_artist(key)
+            # anche i voti: restano solo nel registro (VOTE_JOURNAL_PATH), per le verifiche
+            await save_shared_paths({f"artists/{key}": None, f"votes_popolare/{key}": None, f"votes_tecnica/{key}": None})
+            standings.invalidate()
             await query.edit_message_text(f"_❎ Artista *{escape_markdown(nome)}* rimosso con successo._", parse_mode=ParseMode.MARKDOWN_V2)
         else:
             await query.edit_message_text("Artista non trovato.")
     return MAIN_MENU
 
-def update_artists_file(artists: dict) -> None:
-    content = "artists = " + json.dumps(artists, indent=4, ensure_ascii=False)
-    try:
-        with open("profili.py", "w", encoding="utf-8") as f:
-            f.write(content)
-    except Exception as e:
-        print(f"Errore nell'aggiornamento di profili.py: {e}")
-
 async def telegram_webhook(request: web.Request) -> web.Response:
     app: Application = request.app["bot_app"]
-    data = await request.json()
-    update = Update.de_json(data, app.bot)
-    await app.process_update(update)
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        FILTERED_UPDATES.inc(reason="secret")
+        logger.warning("Richiesta al webhook senza secret token valido da %s.", request.remote, extra={"sample": True})
+        return web.Response(status=403)
+    if not request.app["ingress_owner"].is_set():
+        # replica in standby: Telegram riprova e il bilanciatore lo manda alla replica attiva
+        return web.Response(status=503)
+    try:
+        data = codec.loads(await request.read())
+        # tipi e chat che nessun handler gestisce: 200 senza costruire l'Update
+        reason = skip_reason(data, private_only=PRIVATE_CHATS_ONLY)
+        if reason is not None:
+            FILTERED_UPDATES.inc(reason=reason)
+            return web.Response(status=200)
+        # riconsegna di un update già accettato: 200 così Telegram smette di inviarlo
+        if recent_updates.seen(data["update_id"]):
+            DUPLICATE_UPDATES.inc(source="memory")
+            logger.info("Update %s già ricevuto, scartato.", data["update_id"], extra={"sample": True})
+            return web.Response(status=200)
+        update = Update.de_json(data, app.bot)
+    except Exception as e:
+        logger.error("Update non valido ricevuto sul webhook: %s", e, extra={"sample": True})
+        return web.Response(status=400)
+    # risposta immediata: l'update viene elaborato dai worker
+    if not request.app["ingress"].put(update):
+        logger.warning("Coda degli update piena, update %s rifiutato.", update.update_id, extra={"sample": True})
+        return web.Response(status=503)
+    # registrato solo ora: dopo un 503 la riconsegna di Telegram deve essere elaborata
+    recent_updates.add(update.update_id)
     return web.Response(status=200)
 
 async def health(request):
+    if not request.app["ingress_owner"].is_set():
+        return web.Response(status=503, text="STANDBY")
+    # 503 finché dati e bot non sono pronti: gli update ricevuti nel frattempo restano in coda
+    if not request.app["ready"].is_set():
+        return web.Response(status=503, text="STARTING")
     return web.Response(text="OK")
 
-# Modifica la sezione di configurazione del webhook all'inizio del file
-WEBHOOK_URL = os.environ["WEBHOOK_URL"].rstrip("/")
-WEBHOOK_PATH = f"/{TOKEN}"
-FULL_WEBHOOK = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
-
-# Aggiungi debug logging per verificare la configurazione
-logger.info(f"TOKEN: {TOKEN[:10]}...")  # Mostra solo i primi 10 caratteri per sicurezza
-logger.info(f"WEBHOOK_URL: {WEBHOOK_URL}")
-logger.info(f"WEBHOOK_PATH: {WEBHOOK_PATH}")
-logger.info(f"FULL_WEBHOOK: {FULL_WEBHOOK}")
-
-async def on_startup(aio_app: web.Application):
-    bot_app = Application.builder().token(TOKEN).build()
-
-    # caricare dati bot_data
-    data = load_bot_data()
-    if data:
-        bot_app.bot_data.update(data)
-    # esempi di default
-    bot_app.bot_data.setdefault("artists", {})  # Corretto da [] a {}
-    bot_app.bot_data.setdefault("owners_ids", set())
+async def metrics(request):
+    bot_app: Application = request.app["bot_app"]
+    for jury in ("popolare", "tecnica"):
+        JUDGES.set(len(bot_app.bot_data.get(f"judges_{jury}", ())), jury=jury)
+    QUEUE_DEPTH.set(request.app["ingress"].depth, queue="updates")
+    QUEUE_DEPTH.set(store.pending, queue="firebase_pending")
+    QUEUE_DEPTH.set(session_store.pending, queue="sessions_pending")
+    QUEUE_LAG.set(request.app["ingress"].oldest_lag())
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+async def stats(request):
+    return web.json_response({
+        "ingress": request.app["ingress"].stats(),
+        "duplicates": {"skipped": recent_updates.skipped, "tracked": len(recent_updates)},
+        "firebase": {"mutations": store.mutations, "flushes": store.flushes, "pending": store.pending},
+    })
+
+def build_application() -> Application:
+    """Crea l'Application e registra gli handler, senza chiamate di rete."""
+    persistence = StorePersistence(session_store, update_interval=float(os.getenv("SESSION_PERSIST_SECONDS", 5)))
+    # TimedRequest misura ogni chiamata alla Bot API (pool come quello predefinito di PTB)
+    builder = Application.builder().token(TOKEN).persistence(persistence).request(TimedRequest(connection_pool_size=256))
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    bot_app = builder.build()
 
     # ConversationHandler - correggi il warning
     conv = ConversationHandler(
@@ -980,6 +1410,8 @@ async def on_startup(aio_app: web.Application):
             ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name="giuria",
+        persistent=True,
         per_message=False,  # Cambiato da True a False per evitare il warning
         per_user=True,
         per_chat=True,
@@ -989,38 +1421,205 @@ async def on_startup(aio_app: web.Application):
     bot_app.add_handler(CommandHandler('set', set_limit_command))  # Corretto
     bot_app.add_handler(CommandHandler('artisti', artisti_command))
     bot_app.add_handler(CommandHandler('votazioni', votazioni_command))
+    bot_app.add_handler(CommandHandler('classifica', classifica_command))
+    bot_app.add_handler(CommandHandler('formula', formula_command))
     bot_app.add_handler(CommandHandler('reset', reset_voting))
     bot_app.add_handler(CommandHandler('logout', logout))
     bot_app.add_handler(CommandHandler('cancel', cancel))
     bot_app.add_handler(conv, group=1)
-    bot_app.add_handler(CallbackQueryHandler(owner_button_handler))
+    bot_app.add_handler(CallbackQueryHandler(artists_page_callback, pattern="^artists_page_[0-9]+$"))
+    # solo i pulsanti della tastiera votazioni: gli altri callback sono gestiti dalla conversazione
+    bot_app.add_handler(CallbackQueryHandler(owner_button_handler, pattern="^(artist[0-9]+|stop_voting)$"))
+    # durata di ogni handler in /metrics
+    for handlers in bot_app.handlers.values():
+        instrument_handlers(handlers)
+    return bot_app
+
+async def initialize_bot(aio_app: web.Application) -> None:
+    """Fasi lente dell'avvio, eseguite con il server HTTP già in ascolto."""
+    bot_app: Application = aio_app["bot_app"]
+    started = phase_started = time.perf_counter()
+
+    def log_phase(name: str) -> None:
+        nonlocal phase_started
+        now = time.perf_counter()
+        logger.info("Avvio: %s in %.0f ms", name, (now - phase_started) * 1000)
+        phase_started = now
+
+    if shared is not None:
+        # i dati si caricano solo da replica attiva: così sono quelli salvati dalla precedente
+        await acquire_ingress_lease(aio_app)
+        log_phase("lease dell'ingresso")
+    await store.start()
+    await session_store.start()
+    # dati da Firebase e get_me di Telegram in parallelo
+    data, _ = await asyncio.gather(load_bot_data(), bot_app.initialize())
+    log_phase("caricamento bot_data e inizializzazione bot")
+
+    if data:
+        bot_app.bot_data.update(data)
+    # artisti salvati su Firebase; al primo avvio si parte da quelli di profili.py
+    saved_artists = bot_app.bot_data.get("artists") or {}
+    bot_app.bot_data["artists"] = ArtistStore(saved_artists or initial_artists,
+                                              next_id=bot_app.bot_data.pop("artists_next_id", 1))
+    if not saved_artists and initial_artists:
+        save_bot_data_paths({
+            "artists": bot_app.bot_data["artists"].to_dict(),
+            "artists_next_id": bot_app.bot_data["artists"].next_id,
+        })
+    if shared is not None and await shared.get("artists") is None:
+        # SHARED_STATE=memory (o database vuoto): le repliche partono dagli artisti caricati qui
+        await shared.update({
+            "artists": bot_app.bot_data["artists"].to_dict(),
+            "artists_next_id": bot_app.bot_data["artists"].next_id,
+        })
+    bot_app.bot_data.setdefault("owners_ids", set())
+    # formula scelta con /formula in una sessione precedente
+    saved_scoring = bot_app.bot_data.pop("scoring", None)
+    if saved_scoring:
+        try:
+            votes.set_scoring(ScoringEngine(ScoringConfig.from_dict(saved_scoring)))
+        except ValueError as e:
+            logger.error("Formula della classifica salvata non valida, uso quella di default: %s", e)
+    # i voti restano solo nella matrice, non anche come dict in bot_data
+    votes.rebuild(bot_app.bot_data.pop("votes_popolare", {}), bot_app.bot_data.pop("votes_tecnica", {}))
+    if journal is not None:
+        recovered = recover_journal_votes(bot_app.bot_data["artists"])
+        if recovered:
+            logger.warning("Recuperati dal registro %d voti non ancora salvati su Firebase.", recovered)
+    log_phase("caricamento dei voti")
 
-    await bot_app.initialize()
     await bot_app.start()
 
-    # Imposta il webhook con logging dettagliato
+    # set_webhook solo se URL o parametri sono cambiati: il secret non si può rileggere
+    # da get_webhook_info, quindi si confronta un'impronta salvata all'ultima registrazione
+    webhook_config = {
+        "url": FULL_WEBHOOK,
+        "allowed_updates": ALLOWED_UPDATES,
+        "max_connections": WEBHOOK_MAX_CONNECTIONS,
+        "secret_token": WEBHOOK_SECRET,
+    }
+    fingerprint = hashlib.sha256(json.dumps(webhook_config, sort_keys=True).encode()).hexdigest()
+    saved_fingerprint = bot_app.bot_data.pop("webhook_fingerprint", None)
     try:
         webhook_info = await bot_app.bot.get_webhook_info()
-        logger.info(f"Webhook info attuale: {webhook_info}")
-        
-        result = await bot_app.bot.set_webhook(FULL_WEBHOOK)
-        logger.info(f"Risultato set_webhook: {result}")
-        
-        # Verifica che il webhook sia stato impostato correttamente
-        new_webhook_info = await bot_app.bot.get_webhook_info()
-        logger.info(f"Nuovo webhook info: {new_webhook_info}")
-        
+        if webhook_info.url == FULL_WEBHOOK and saved_fingerprint == fingerprint:
+            logger.info("Webhook già impostato, set_webhook non necessario.")
+        else:
+            result = await bot_app.bot.set_webhook(**webhook_config)
+            save_bot_data_paths({"webhook_fingerprint": fingerprint})
+            logger.info("Risultato set_webhook: %s", result)
     except Exception as e:
-        logger.error(f"Errore nell'impostazione del webhook: {e}")
+        logger.error("Errore nell'impostazione del webhook: %s", e)
+    log_phase("webhook")
+
+    notifier.start(
+        bot_app.bot,
+        owners=lambda: bot_app.bot_data.get("owners_ids", set()),
+        running_average=votes.average,
+    )
+
+    aio_app["ready"].set()
+    logger.info("Bot pronto in %.0f ms", (time.perf_counter() - started) * 1000)
 
+async def on_startup(aio_app: web.Application):
+    bot_app = build_application()
     aio_app["bot_app"] = bot_app
-    logger.info("Webhook impostato su: %s", FULL_WEBHOOK)
+    aio_app["ready"] = asyncio.Event()
+    aio_app["ingress_owner"] = asyncio.Event()
+    if shared is None:
+        aio_app["ingress_owner"].set()
+
+    async def process_when_ready(update: Update) -> None:
+        await aio_app["ready"].wait()
+        if SHARED_DEDUP and not await claim_update(update.update_id):
+            DUPLICATE_UPDATES.inc(source="shared")
+            logger.info("Update %s già elaborato da un'altra istanza, scartato.", update.update_id,
+                        extra={"sample": True})
+            return
+        # update_id e chat_id finiscono in tutti i log emessi durante l'elaborazione
+        with log_context(update.update_id, chat_key(update)):
+            started = time.perf_counter()
+            logger.debug("Update ricevuto: %s", _update_kind(update))
+            await bot_app.process_update(update)
+            logger.debug("Update elaborato in %.1f ms", (time.perf_counter() - started) * 1000)
+
+    # la coda accetta gli update già durante l'avvio; i worker attendono che il bot sia pronto
+    ingress = UpdateQueue(
+        process_when_ready,
+        workers=int(os.getenv("UPDATE_WORKERS", 8)),
+        max_size=int(os.getenv("UPDATE_QUEUE_SIZE", 1000)),
+    )
+    ingress.start()
+    aio_app["ingress"] = ingress
+
+    # il resto dell'avvio prosegue in background, così la porta viene aperta subito
+    aio_app["init_task"] = asyncio.create_task(initialize_bot(aio_app))
+    aio_app["init_task"].add_done_callback(_log_init_failure)
+
+def _update_kind(update: Update) -> str:
+    if update.callback_query is not None:
+        return f"callback {update.callback_query.data}"
+    if update.message is not None:
+        return "comando" if (update.message.text or "").startswith("/") else "messaggio"
+    return "altro"
+
+def _log_init_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Errore durante l'avvio del bot: %s", task.exception())
 
 async def on_cleanup(aio_app: web.Application):
     bot_app: Application = aio_app["bot_app"]
-    await bot_app.stop()
+    ready = aio_app["ready"].is_set()
+    init_task: asyncio.Task = aio_app["init_task"]
+    if not init_task.done():
+        init_task.cancel()
+        await asyncio.gather(init_task, return_exceptions=True)
+    lease_task: Optional[asyncio.Task] = aio_app.get("lease_task")
+    if lease_task is not None:
+        lease_task.cancel()
+        await asyncio.gather(lease_task, return_exceptions=True)
+    # prima si elaborano gli update già accettati (se il bot è partito)
+    await aio_app["ingress"].stop(drain=ready)
+    # ultimo riepilogo ai proprietari finché il bot è ancora attivo
+    await notifier.shutdown()
+    if bot_app.running:
+        await bot_app.stop()
     await bot_app.shutdown()
+    await session_store.shutdown()
+    await uploader.shutdown()
+    if journal is not None:
+        journal.close()
+    if shared is not None:
+        if aio_app["ingress_owner"].is_set():
+            # dopo aver salvato tutto: la replica in standby può subentrare subito
+            await store.flush()
+            try:
+                await shared.release_lease("ingress_lease", REPLICA_ID)
+            except Exception as e:
+                logger.error("Errore nel rilascio del lease dell'ingresso: %s", e)
+        shared.close()
+    # svuota la coda di scrittura prima di chiudere
+    await store.shutdown()
+
+
+def create_web_app() -> web.Application:
+    """Server aiohttp con webhook, health-check e statistiche (usato anche da bench/)."""
+    aio_app = web.Application(middlewares=[metrics_middleware])
+    aio_app.on_startup.append(on_startup)
+    aio_app.on_cleanup.append(on_cleanup)
 
+    # health-check (opzionale ma utile)
+    aio_app.router.add_get("/", health, name="health")
+    # profondità della coda degli update e contatori di scrittura
+    aio_app.router.add_get("/stats", stats, name="stats")
+    # latenze di handler, Bot API, Firebase e Cloudinary in formato Prometheus
+    aio_app.router.add_get("/metrics", metrics, name="metrics")
+
+    # monta l'unico POST che serve, su /<TOKEN>
+    aio_app.router.add_post(WEBHOOK_PATH, telegram_webhook, name="webhook")
+    logger.info("Route POST del webhook configurata.")
+    return aio_app
 
 def main():
     # Verifica che TOKEN sia impostato
@@ -1029,29 +1628,16 @@ def main():
         return
     
     # Verifica che WEBHOOK_URL sia impostato
-    webhook_url = os.environ.get("WEBHOOK_URL")
-    if not webhook_url:
+    if not WEBHOOK_URL:
         logger.error("WEBHOOK_URL non impostato nelle variabili d'ambiente!")
         return
-    
-    logger.info(f"Avvio bot con TOKEN: {TOKEN[:10]}...")
-    logger.info(f"WEBHOOK_URL: {webhook_url}")
-    logger.info(f"WEBHOOK_PATH: {WEBHOOK_PATH}")
-    logger.info(f"FULL_WEBHOOK: {FULL_WEBHOOK}")
-    
-    aio_app = web.Application()
-    aio_app.on_startup.append(on_startup)
-    aio_app.on_cleanup.append(on_cleanup)
-
-    # health-check (opzionale ma utile)
-    aio_app.router.add_get("/", health)
 
-    # monta l'unico POST che serve, su /<TOKEN>
-    aio_app.router.add_post(WEBHOOK_PATH, telegram_webhook)
-    logger.info(f"Route POST configurata su: {WEBHOOK_PATH}")
+    # il token non viene mai scritto nei log
+    logger.info("Avvio bot, WEBHOOK_URL: %s", WEBHOOK_URL)
 
+    aio_app = create_web_app()
     port = int(os.environ.get("PORT", 10000))
-    logger.info(f"Avvio server su porta: {port}")
+    logger.info("Avvio server su porta: %s", port)
     web.run_app(aio_app, host="0.0.0.0", port=port)
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional, Set
+
+from metrics import CLOUDINARY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Associa l'URL di una foto al file_id Telegram ottenuto dal primo invio.
+
+    Inviando il file_id Telegram non deve riscaricare l'immagine da
+    Cloudinary a ogni messaggio.
+    """
+
+    def __init__(self):
+        self._file_ids: Dict[str, str] = {}
+
+    def get(self, url: str) -> str:
+        """Restituisce il file_id se noto, altrimenti l'URL originale."""
+        return self._file_ids.get(url, url)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._file_ids
+
+    def remember(self, url: str, message) -> Optional[str]:
+        """Salva il file_id della foto più grande contenuta nel messaggio inviato."""
+        if not url or message is None or not getattr(message, "photo", None):
+            return None
+        file_id = message.photo[-1].file_id
+        if self._file_ids.get(url) != file_id:
+            self._file_ids[url] = file_id
+            logger.debug("file_id memorizzato per %s", url)
+        return file_id
+
+    def forget(self, url: Optional[str]) -> None:
+        if url:
+            self._file_ids.pop(url, None)
+
+
+# blocchi di upload_large: Cloudinary richiede almeno 5 MB per blocco (tranne l'ultimo)
+STREAM_CHUNK_SIZE = 6 * 1024 * 1024
+
+
+class DownloadStream(io.RawIOBase):
+    """File in sola lettura che scarica `url` a blocchi mentre viene letto.
+
+    Pensato per cloudinary.uploader.upload_large: in memoria resta al più un
+    blocco, non l'intera foto. `size` (noto da Telegram) serve all'SDK per
+    l'header Content-Range; seek permette solo di leggere la dimensione.
+    """
+
+    def __init__(self, url: str, size: int, chunk_size: int = STREAM_CHUNK_SIZE, timeout: float = 30.0):
+        self.url = url
+        self.name = os.path.basename(url.split("?", 1)[0]) or "stream"
+        self._size = size
+        self._chunk_size = chunk_size
+        self._timeout = timeout
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._buffer = b""
+        self._position = 0
+        self._probe: Optional[int] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position if self._probe is None else self._probe
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_END:
+            self._probe = self._size + offset
+        elif whence == io.SEEK_SET and offset == self._position:
+            self._probe = None
+        else:
+            raise io.UnsupportedOperation("DownloadStream si legge solo in avanti")
+        return self.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        if self._chunks is None:
+            self._chunks = self._download()
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self._position += len(data)
+        return data
+
+    def close(self) -> None:
+        if self._chunks is not None:
+            # chiude la risposta HTTP se l'upload si interrompe prima della fine
+            self._chunks.close()
+            self._chunks = None
+        super().close()
+
+    def _download(self) -> Iterator[bytes]:
+        import httpx
+
+        with httpx.stream("GET", self.url, timeout=self._timeout) as response:
+            response.raise_for_status()
+            yield from response.iter_bytes(self._chunk_size)
+
+
+class MediaUploader:
+    """Upload ed eliminazioni Cloudinary eseguiti in un pool di thread.
+
+    L'SDK di Cloudinary è sincrono: chiamarlo dall'handler fermerebbe tutto
+    il bot, voti compresi, per la durata dell'upload. Le eliminazioni delle
+    vecchie immagini partono in background e vengono ritentate.
+
+    Con `stream=True` la foto viene scaricata da Telegram a blocchi e
+    caricata con upload_large mentre arriva (DownloadStream): Cloudinary non
+    riceve l'URL del file, che contiene il token del bot, e in memoria resta
+    un blocco di `chunk_size` byte alla volta invece dell'intera foto.
+
+    L'SDK viene importato e configurato solo al primo utilizzo, con le
+    opzioni di `config` (cloud_name, api_key, api_secret).
+    """
+
+    def __init__(self, max_workers: int = 4, stream: bool = False, destroy_attempts: int = 3,
+                 config: Optional[dict] = None, chunk_size: int = STREAM_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.config = config or {}
+        self._configured = False
+        self.destroy_attempts = destroy_attempts
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cloudinary")
+        self._background: Set[asyncio.Task] = set()
+
+    def _uploader(self):
+        import cloudinary
+        import cloudinary.uploader
+
+        if not self._configured:
+            cloudinary.config(**self.config)
+            self._configured = True
+        return cloudinary.uploader
+
+    async def upload(self, source, **options) -> dict:
+        loop = asyncio.get_running_loop()
+
+        def call():
+            with CLOUDINARY_SECONDS.time(operation="upload"):
+                return self._uploader().upload(source, **options)
+
+        return await loop.run_in_executor(self._executor, call)
+
+    async def upload_telegram_file(self, file, **options) -> dict:
+        """Carica su Cloudinary un telegram.File ottenuto con bot.get_file."""
+        # senza dimensione (o con un file locale del Bot API server) Cloudinary riceve il percorso
+        if not self.stream or not file.file_size or not file.file_path.startswith(("http://", "https://")):
+            return await self.upload(file.file_path, **options)
+        loop = asyncio.get_running_loop()
+
+        def call():
+            # download e upload nello stesso thread del pool, un blocco alla volta
+            stream = DownloadStream(file.file_path, file.file_size, self.chunk_size)
+            with CLOUDINARY_SECONDS.time(operation="upload"):
+                return self._uploader().upload_large(
+                    stream, resource_type="image", chunk_size=self.chunk_size, **options
+                )
+
+        return await loop.run_in_executor(self._executor, call)
+
+    def destroy_later(self, public_id: Optional[str]) -> None:
+        """Elimina l'immagine in background, senza far attendere l'handler."""
+        if not public_id:
+            return
+        task = asyncio.get_running_loop().create_task(self._destroy(public_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _destroy(self, public_id: str) -> None:
+        loop = asyncio.get_running_loop()
+
+        def call():
+            with CLOUDINARY_SECONDS.time(operation="destroy"):
+                return self._uploader().destroy(public_id)
+
+        for attempt in range(1, self.destroy_attempts + 1):
+            try:
+                await loop.run_in_executor(self._executor, call)
+                logger.info("Immagine %s eliminata da Cloudinary.", public_id)
+                return
+            except Exception as e:
+                logger.error("Errore durante l'eliminazione dell'immagine %s da Cloudinary (tentativo %d/%d): %s",
+                             public_id, attempt, self.destroy_attempts, e)
+                if attempt < self.destroy_attempts:
+                    await asyncio.sleep(2 ** attempt)
+
+    async def shutdown(self) -> None:
+        """Attende le eliminazioni ancora in corso e chiude il pool."""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,221 @@
+import functools
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from aiohttp import web
+from telegram.request import HTTPXRequest
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        # osservazioni anche dai thread di Firebase e Cloudinary
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self) -> Iterable[str]:
+        return ()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {value}"
+
+
+class Gauge(Counter):
+    """Valore istantaneo, aggiornato con `set` subito prima di ogni lettura di /metrics."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per etichetta: conteggi per bucket (non cumulativi), somma, totale
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> Iterable[str]:
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {count}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {total}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {count}"
+
+
+class _Timer:
+    """Context manager che osserva la durata del blocco; l'etichetta `status` vale ok/error."""
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, object]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        labels = dict(self.labels)
+        if "status" in self.histogram.label_names:
+            labels["status"] = "error" if exc_type else "ok"
+        self.histogram.observe(time.perf_counter() - self.started, **labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "sakurabot_handler_seconds", "Durata degli handler del bot.", ["handler", "status"]))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "sakurabot_http_request_seconds", "Durata delle richieste HTTP ricevute.", ["route", "status"]))
+TELEGRAM_SECONDS = REGISTRY.register(Histogram(
+    "sakurabot_telegram_api_seconds", "Durata delle chiamate alla Bot API.", ["method", "status"]))
+FIREBASE_SECONDS = REGISTRY.register(Histogram(
+    "sakurabot_firebase_seconds", "Durata delle letture e scritture su Firebase.", ["operation", "status"]))
+CLOUDINARY_SECONDS = REGISTRY.register(Histogram(
+    "sakurabot_cloudinary_seconds", "Durata di upload ed eliminazioni su Cloudinary.", ["operation", "status"]))
+VOTES = REGISTRY.register(Counter(
+    "sakurabot_votes_total", "Voti ricevuti per giuria ed esito.", ["jury", "result"]))
+DUPLICATE_UPDATES = REGISTRY.register(Counter(
+    "sakurabot_duplicate_updates_total", "Update riconsegnati da Telegram e scartati.", ["source"]))
+FILTERED_UPDATES = REGISTRY.register(Counter(
+    "sakurabot_filtered_updates_total", "Richieste al webhook scartate prima dell'elaborazione.", ["reason"]))
+JUDGES = REGISTRY.register(Gauge(
+    "sakurabot_judges", "Giudici registrati per giuria.", ["jury"]))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "sakurabot_queue_depth", "Elementi in attesa nelle code interne.", ["queue"]))
+QUEUE_LAG = REGISTRY.register(Gauge(
+    "sakurabot_update_queue_lag_seconds", "Attesa dell'update più vecchio ancora in coda."))
+
+
+def timed_handler(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Avvolge un callback PTB registrandone la durata in HANDLER_SECONDS."""
+    name = name or getattr(callback, "__name__", "handler")
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with HANDLER_SECONDS.time(handler=name):
+            return await callback(update, context)
+
+    return wrapper
+
+
+def instrument_handlers(handlers: Iterable) -> None:
+    """Misura tutti i callback, compresi quelli annidati nelle ConversationHandler."""
+    for handler in handlers:
+        if hasattr(handler, "entry_points"):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif callable(getattr(handler, "callback", None)) and not hasattr(handler.callback, "__wrapped__"):
+            handler.callback = timed_handler(handler.callback)
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest che registra la durata di ogni chiamata alla Bot API."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with TELEGRAM_SECONDS.time(method=url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    # il nome della rotta, non il path: quello del webhook contiene il token
+    route = request.match_info.route.name or "other"
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_SECONDS.observe(time.perf_counter() - started, route=route, status=status)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.constants import ParseMode
+from telegram.helpers import escape_markdown
+
+from broadcast import Broadcaster
+
+logger = logging.getLogger(__name__)
+
+# Oltre questo numero le registrazioni nel riepilogo vengono solo contate
+MAX_REGISTRATIONS_LISTED = 20
+
+
+class OwnerNotifier:
+    """Raccoglie le notifiche per i proprietari e le invia come riepilogo periodico.
+
+    Gli handler dei giudici si limitano a registrare l'evento; ogni
+    `interval` secondi viene inviato un solo messaggio per proprietario con
+    le nuove registrazioni e il numero di voti per artista, con la media
+    aggiornata.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, interval: float = 5.0):
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self._registrations: List[str] = []
+        self._votes: Dict[Tuple[str, str], int] = {}
+        self._artist_names: Dict[str, str] = {}
+        self._bot = None
+        self._owners: Callable[[], Iterable[int]] = lambda: ()
+        self._running_average: Callable[[str, str], float] = lambda artist_key, jury: 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def start(self, bot, owners: Callable[[], Iterable[int]],
+              running_average: Callable[[str, str], float]) -> None:
+        self._bot = bot
+        self._owners = owners
+        self._running_average = running_average
+        self._lock = asyncio.Lock()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def registration(self, clickable_name: str, jury_type: str) -> None:
+        """Registra un nuovo giudice; `clickable_name` è già in MarkdownV2."""
+        self._registrations.append(f"{clickable_name} \\({jury_type}\\)")
+
+    def vote(self, artist_key: str, artist_name: str, jury_type: str) -> None:
+        """Registra un voto popolare o una scheda tecnica completata."""
+        self._artist_names[artist_key] = artist_name
+        key = (artist_key, jury_type)
+        self._votes[key] = self._votes.get(key, 0) + 1
+
+    def render(self) -> Optional[str]:
+        if not self._registrations and not self._votes:
+            return None
+        parts = ["*📊 Aggiornamento votazioni*"]
+        if self._registrations:
+            listed = ", ".join(self._registrations[:MAX_REGISTRATIONS_LISTED])
+            others = len(self._registrations) - MAX_REGISTRATIONS_LISTED
+            if others > 0:
+                listed += f" e altri {others}"
+            parts.append(f"\n_👤 Nuovi giudici registrati \\({len(self._registrations)}\\)\\:_ {listed}")
+        by_artist: Dict[str, List[str]] = {}
+        for (artist_key, jury_type), count in self._votes.items():
+            label = "voti popolari" if jury_type == "popolare" else "schede tecniche"
+            if count == 1:
+                label = "voto popolare" if jury_type == "popolare" else "scheda tecnica"
+            avg = escape_markdown(f"{self._running_average(artist_key, jury_type):.2f}", version=2)
+            by_artist.setdefault(artist_key, []).append(f"{count} {label} \\(media {avg}\\)")
+        for artist_key, entries in by_artist.items():
+            nome = escape_markdown(self._artist_names.get(artist_key, artist_key), version=2)
+            parts.append(f"🔝 *{nome}*\\: " + ", ".join(entries))
+        return "\n".join(parts)
+
+    async def flush(self) -> None:
+        """Invia subito il riepilogo degli eventi accumulati."""
+        if self._bot is None or self._lock is None:
+            return
+        async with self._lock:
+            text = self.render()
+            self._registrations = []
+            self._votes = {}
+            owners = list(self._owners())
+            if not text or not owners:
+                return
+
+            async def send(owner_id):
+                return await self._bot.send_message(chat_id=owner_id, text=text, parse_mode=ParseMode.MARKDOWN_V2)
+
+            await self.broadcaster.send(owners, send)
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Errore nell'invio del riepilogo ai proprietari: %s", e)
@@ -0,0 +1,122 @@
+import copy
+import logging
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import BotDataStore
+
+logger = logging.getLogger(__name__)
+
+
+def _to_int(key):
+    # Firebase restituisce le chiavi come stringhe
+    return int(key) if isinstance(key, str) and key.lstrip("-").isdigit() else key
+
+
+def _conversation_path(key: Tuple) -> str:
+    return "_".join(str(part) for part in key)
+
+
+def _conversation_key(path: str) -> Tuple:
+    return tuple(_to_int(part) for part in path.split("_"))
+
+
+class StorePersistence(BasePersistence):
+    """Persistenza PTB per user_data e stati delle ConversationHandler.
+
+    All'avvio viene fatta una sola lettura dell'intero nodo; in seguito
+    vengono scritti soltanto gli utenti e le conversazioni effettivamente
+    cambiati (confrontati con l'ultima versione salvata), attraverso il
+    buffer write-behind di BotDataStore.
+
+    bot_data non è gestito qui: resta salvato da save_bot_data_paths.
+    """
+
+    def __init__(self, store: BotDataStore, update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self._loaded: Optional[dict] = None
+        self._user_data: Dict[int, dict] = {}
+        self._conversations: Dict[str, Dict[Tuple, object]] = {}
+
+    async def _load(self) -> dict:
+        if self._loaded is None:
+            try:
+                self._loaded = await self.store.load() or {}
+            except Exception as e:
+                logger.error("Errore nel caricamento delle sessioni da Firebase: %s", e)
+                self._loaded = {}
+            self._user_data = {
+                _to_int(user_id): data or {}
+                for user_id, data in (self._loaded.get("user_data") or {}).items()
+            }
+            self._conversations = {
+                name: {_conversation_key(path): state for path, state in (states or {}).items()}
+                for name, states in (self._loaded.get("conversations") or {}).items()
+            }
+        return self._loaded
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        await self._load()
+        return copy.deepcopy(self._user_data)
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        await self._load()
+        return dict(self._conversations.get(name, {}))
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        states = self._conversations.setdefault(name, {})
+        if states.get(key) == new_state:
+            return
+        if new_state is None:
+            states.pop(key, None)
+        else:
+            states[key] = new_state
+        self.store.update({f"conversations/{name}/{_conversation_path(key)}": new_state})
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if self._user_data.get(user_id) == data:
+            return
+        self._user_data[user_id] = copy.deepcopy(data)
+        self.store.update({f"user_data/{user_id}": copy.deepcopy(data) or None})
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._user_data.pop(user_id, None)
+        self.store.update({f"user_data/{user_id}": None})
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await self.store.flush()
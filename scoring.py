@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+METHODS = ("media", "mediana", "troncata")
+
+
+@dataclass
+class ScoringConfig:
+    """Formula della classifica.
+
+    - `method`: come si combinano i voti dei giudici di un artista: media,
+      mediana o media troncata (scarta la quota `trim` dei voti più alti e
+      più bassi);
+    - `jury_weights`: peso delle giurie nel punteggio finale;
+    - `ambito_weights`: peso di ogni ambito nella scheda tecnica (stesso
+      ordine di TECHNICAL_AMBITI; vuoto = pesi uguali);
+    - `zscore`: normalizza i voti di ogni giudice (media 0, deviazione 1
+      sugli artisti che ha votato) per neutralizzare giudici troppo severi
+      o generosi; i punteggi vengono riportati sulla scala dei voti.
+    """
+
+    method: str = "media"
+    trim: float = 0.1
+    jury_weights: Dict[str, float] = field(default_factory=lambda: {"popolare": 1.0, "tecnica": 1.0})
+    ambito_weights: List[float] = field(default_factory=list)
+    zscore: bool = False
+
+    def __post_init__(self):
+        if self.method not in METHODS:
+            raise ValueError(f"Metodo sconosciuto: {self.method} (disponibili: {', '.join(METHODS)})")
+        if not 0 <= self.trim < 0.5:
+            raise ValueError("La quota da scartare deve essere tra 0 e 0.5")
+        if any(weight < 0 for weight in self.jury_weights.values()) or not sum(self.jury_weights.values()):
+            raise ValueError("I pesi delle giurie devono essere positivi")
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "trim": self.trim,
+            "jury_weights": dict(self.jury_weights),
+            "ambito_weights": list(self.ambito_weights),
+            "zscore": self.zscore,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "ScoringConfig":
+        data = data or {}
+        return cls(
+            method=data.get("method", "media"),
+            trim=float(data.get("trim", 0.1)),
+            jury_weights={k: float(v) for k, v in (data.get("jury_weights") or {"popolare": 1, "tecnica": 1}).items()},
+            ambito_weights=[float(w) for w in data.get("ambito_weights") or []],
+            zscore=bool(data.get("zscore", False)),
+        )
+
+
+def _sorted_valid(scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Voti ordinati per riga (NaN in fondo) e numero di voti validi per riga."""
+    return np.sort(scores, axis=1), (~np.isnan(scores)).sum(axis=1)
+
+
+def _combine(scores: np.ndarray, method: str, trim: float) -> np.ndarray:
+    """Combina i voti di ogni riga (artista × giudice, NaN = non votato); 0 se nessun voto."""
+    rows = scores.shape[0]
+    if scores.shape[1] == 0:
+        return np.zeros(rows)
+    if method == "media":
+        counts = (~np.isnan(scores)).sum(axis=1)
+        sums = np.nansum(scores, axis=1, dtype=np.float64)
+        return np.divide(sums, counts, out=np.zeros(rows), where=counts > 0)
+    ordered, counts = _sorted_valid(scores.astype(np.float64))
+    if method == "mediana":
+        lo = np.maximum((counts - 1) // 2, 0)
+        hi = np.maximum(counts // 2, 0)
+        lo_values = np.take_along_axis(ordered, lo[:, None], axis=1)[:, 0]
+        hi_values = np.take_along_axis(ordered, np.minimum(hi, scores.shape[1] - 1)[:, None], axis=1)[:, 0]
+        return np.where(counts > 0, (lo_values + hi_values) / 2, 0.0)
+    # media troncata: stessi voti scartati in alto e in basso
+    cut = np.floor(counts * trim).astype(np.int64)
+    index = np.arange(scores.shape[1])[None, :]
+    keep = (index >= cut[:, None]) & (index < (counts - cut)[:, None])
+    kept = keep.sum(axis=1)
+    sums = np.where(keep, ordered, 0.0).sum(axis=1)
+    return np.divide(sums, kept, out=np.zeros(rows), where=kept > 0)
+
+
+def _zscore(scores: np.ndarray) -> np.ndarray:
+    """Normalizza ogni colonna (giudice) e riporta tutto su media e deviazione globali."""
+    voted = ~np.isnan(scores)
+    if not voted.any():
+        return scores
+    counts = voted.sum(axis=0)
+    means = np.divide(np.nansum(scores, axis=0), counts, out=np.zeros(scores.shape[1]), where=counts > 0)
+    deviations = np.where(voted, scores - means, 0.0)
+    stds = np.sqrt(np.divide((deviations ** 2).sum(axis=0), counts, out=np.zeros(scores.shape[1]), where=counts > 0))
+    z = np.divide(deviations, stds, out=np.zeros(scores.shape), where=stds > 0)
+    global_mean = float(np.nanmean(scores))
+    global_std = float(np.nanstd(scores))
+    return np.where(voted, z * global_std + global_mean, np.nan)
+
+
+class ScoringEngine:
+    """Calcola in blocco i punteggi di tutti gli artisti secondo uno ScoringConfig.
+
+    Lavora direttamente sulle matrici di VoteMatrix (artista × giudice e
+    artista × giudice × ambito, NaN dove manca il voto): nessun ciclo per
+    artista o per giudice.
+    """
+
+    def __init__(self, config: Optional[ScoringConfig] = None):
+        self.config = config or ScoringConfig()
+
+    @property
+    def plain_mean(self) -> bool:
+        """True se popolare e tecnica sono le medie semplici (già calcolate da VoteMatrix)."""
+        config = self.config
+        return config.method == "media" and not config.zscore and len(set(config.ambito_weights)) <= 1
+
+    def combine(self, pop: np.ndarray, tech: np.ndarray) -> np.ndarray:
+        """Punteggio finale: media delle giurie pesata con `jury_weights`."""
+        w_pop = self.config.jury_weights.get("popolare", 0.0)
+        w_tech = self.config.jury_weights.get("tecnica", 0.0)
+        return (w_pop * pop + w_tech * tech) / (w_pop + w_tech)
+
+    def score(self, popolare: np.ndarray, tecnica: np.ndarray) -> Dict[str, np.ndarray]:
+        config = self.config
+        popolare = popolare.astype(np.float64)
+        if config.zscore:
+            popolare = _zscore(popolare)
+        pop = _combine(popolare, config.method, config.trim)
+
+        ballots = self._ballots(tecnica.astype(np.float64))
+        if config.zscore:
+            ballots = _zscore(ballots)
+        tech = _combine(ballots, config.method, config.trim)
+
+        return {"popolare": pop, "tecnica": tech, "overall": self.combine(pop, tech)}
+
+    def _ballots(self, tecnica: np.ndarray) -> np.ndarray:
+        """Valore di ogni scheda tecnica (artista × giudice): media pesata degli ambiti votati."""
+        ambiti = tecnica.shape[2]
+        weights = np.asarray(self.config.ambito_weights or [1.0] * ambiti, dtype=np.float64)[:ambiti]
+        voted = ~np.isnan(tecnica)
+        weight_sums = (voted * weights).sum(axis=2)
+        sums = (np.where(voted, tecnica, 0.0) * weights).sum(axis=2)
+        ballots = np.full(weight_sums.shape, np.nan)
+        np.divide(sums, weight_sums, out=ballots, where=weight_sums > 0)
+        return ballots
+
+    def describe(self) -> str:
+        config = self.config
+        method = f"media troncata al {config.trim:.0%}" if config.method == "troncata" else config.method
+        weights = ", ".join(f"{jury} {weight:g}" for jury, weight in config.jury_weights.items())
+        parts = [method, f"pesi giurie: {weights}"]
+        if config.ambito_weights:
+            parts.append("pesi ambiti: " + ", ".join(f"{w:g}" for w in config.ambito_weights))
+        if config.zscore:
+            parts.append("voti normalizzati per giudice (z-score)")
+        return "; ".join(parts)
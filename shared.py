@@ -0,0 +1,241 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import BotDataStore
+
+# Esiti di add_judge
+JUDGE_ADDED = "added"
+JUDGE_PRESENT = "present"
+JUDGE_LIMIT = "limit"
+
+
+def _judge_transaction(chat_id: int, max_limit: Optional[int]):
+    """Funzione di transazione per la lista dei giudici; l'esito finisce in `outcome[0]`."""
+    outcome = [JUDGE_ADDED]
+
+    def update(current):
+        judges = list(current or [])
+        if chat_id in judges:
+            outcome[0] = JUDGE_PRESENT
+            return judges
+        if max_limit and len(judges) >= max_limit:
+            outcome[0] = JUDGE_LIMIT
+            return judges
+        outcome[0] = JUDGE_ADDED
+        return judges + [chat_id]
+
+    return update, outcome
+
+
+def _increment(minimum: int):
+    def update(current):
+        return max(int(current or 0), minimum) + 1
+
+    return update
+
+
+def _lease_transaction(owner: str, ttl: float, now: float):
+    """Funzione di transazione per un lease; `acquired[0]` dice se `owner` lo detiene."""
+    acquired = [False]
+
+    def update(current):
+        if current and current.get("owner") != owner and current.get("expires", 0) > now:
+            acquired[0] = False
+            return current
+        acquired[0] = True
+        return {"owner": owner, "expires": now + ttl}
+
+    return update, acquired
+
+
+def _release_transaction(owner: str):
+    def update(current):
+        return None if current and current.get("owner") == owner else current
+
+    return update
+
+
+class FirebaseSharedState:
+    """Operazioni atomiche su bot_data condivise tra più repliche del bot.
+
+    Voti e registrazioni dei giudici passano da transazioni Firebase, così
+    due repliche (es. quella uscente e quella che subentra) non possono
+    sovrascriversi a vicenda; le scritture sono
+    immediate e non passano dal buffer di BotDataStore. Le chiamate usano
+    un pool di `workers` thread separato da quello delle scritture
+    bufferizzate, così voti di giudici diversi procedono in parallelo.
+    """
+
+    def __init__(self, store: BotDataStore, workers: int = 16):
+        self.store = store
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cache: Dict[str, Tuple[Any, float]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def _run(self, fn) -> Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="firebase-shared")
+        return await self.store.run(fn, executor=self._executor)
+
+    async def get(self, path: str) -> Any:
+        return await self._run(lambda ref: ref.child(path).get())
+
+    async def get_keys(self, path: str) -> List[str]:
+        """Solo le chiavi figlie del nodo (lettura shallow, senza scaricare i valori)."""
+        return list(await self._run(lambda ref: ref.child(path).get(shallow=True)) or {})
+
+    async def get_cached(self, path: str, max_age: float) -> Any:
+        """Come get, ma riusa per `max_age` secondi l'ultimo valore letto o scritto da questa replica.
+
+        Le letture concorrenti dello stesso percorso condividono una sola richiesta.
+        """
+        cached = self._cache.get(path)
+        if cached is not None and time.monotonic() - cached[1] < max_age:
+            return cached[0]
+        started = time.monotonic()
+        pending = self._inflight.get(path)
+        if pending is None:
+            pending = self._inflight[path] = asyncio.ensure_future(self.get(path))
+            pending.add_done_callback(lambda _: self._inflight.pop(path, None))
+        value = await pending
+        cached = self._cache.get(path)
+        if cached is not None and cached[1] >= started:
+            # scritto da set() mentre la lettura era in corso: vale il valore più recente
+            return cached[0]
+        self._cache[path] = (value, time.monotonic())
+        return value
+
+    def _invalidate(self, path: str) -> None:
+        # il percorso e i nodi che lo contengono (es. judge_types per judge_types/123)
+        parts = path.split("/")
+        for i in range(1, len(parts) + 1):
+            self._cache.pop("/".join(parts[:i]), None)
+
+    async def set(self, path: str, value: Any) -> None:
+        self._invalidate(path)
+        # in cache già prima della scrittura: i voti arrivati nel frattempo vedono il nuovo valore
+        self._cache[path] = (value, time.monotonic())
+        await self._run(lambda ref: ref.child(path).set(value))
+        self._cache[path] = (value, time.monotonic())
+
+    async def update(self, changes: dict) -> None:
+        """Scrive più percorsi in una sola richiesta (valore None = elimina)."""
+        await self._run(lambda ref: ref.update(changes))
+        for path in changes:
+            self._invalidate(path)
+
+    async def set_if_absent(self, path: str, value: Any) -> bool:
+        """Scrive `value` solo se il percorso è vuoto; False se esisteva già."""
+        created = [False]
+
+        def update(current):
+            created[0] = current is None
+            return value if current is None else current
+
+        await self._run(lambda ref: ref.child(path).transaction(update))
+        return created[0]
+
+    async def increment(self, path: str, minimum: int = 0) -> int:
+        """Incrementa il contatore (partendo da almeno `minimum`) e restituisce il nuovo valore."""
+        self._invalidate(path)
+        return await self._run(lambda ref: ref.child(path).transaction(_increment(minimum)))
+
+    async def acquire_lease(self, path: str, owner: str, ttl: float) -> bool:
+        """Prende o rinnova il lease `path` per `ttl` secondi; False se lo detiene un'altra replica."""
+        update, acquired = _lease_transaction(owner, ttl, time.time())
+        await self._run(lambda ref: ref.child(path).transaction(update))
+        return acquired[0]
+
+    async def release_lease(self, path: str, owner: str) -> None:
+        await self._run(lambda ref: ref.child(path).transaction(_release_transaction(owner)))
+
+    async def add_judge(self, jury_type: str, chat_id: int, max_limit: Optional[int]) -> str:
+        update, outcome = _judge_transaction(chat_id, max_limit)
+        await self._run(lambda ref: ref.child(f"judges_{jury_type}").transaction(update))
+        self._invalidate(f"judges_{jury_type}")
+        return outcome[0]
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class MemorySharedState:
+    """Stessa interfaccia di FirebaseSharedState su un dict locale (sviluppo e prove)."""
+
+    def __init__(self):
+        self.data: dict = {}
+        self._lock = asyncio.Lock()
+
+    def _get(self, path: str) -> Any:
+        node = self.data
+        for part in path.split("/"):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _set(self, path: str, value: Any) -> None:
+        parts = path.split("/")
+        node = self.data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+
+    async def get(self, path: str) -> Any:
+        return self._get(path)
+
+    async def get_keys(self, path: str) -> List[str]:
+        node = self._get(path)
+        return list(node) if isinstance(node, dict) else []
+
+    async def get_cached(self, path: str, max_age: float) -> Any:
+        return self._get(path)
+
+    async def set(self, path: str, value: Any) -> None:
+        async with self._lock:
+            self._set(path, value)
+
+    async def update(self, changes: dict) -> None:
+        async with self._lock:
+            for path, value in changes.items():
+                self._set(path, value)
+
+    async def set_if_absent(self, path: str, value: Any) -> bool:
+        async with self._lock:
+            if self._get(path) is not None:
+                return False
+            self._set(path, value)
+            return True
+
+    async def increment(self, path: str, minimum: int = 0) -> int:
+        async with self._lock:
+            value = _increment(minimum)(self._get(path))
+            self._set(path, value)
+            return value
+
+    async def acquire_lease(self, path: str, owner: str, ttl: float) -> bool:
+        async with self._lock:
+            update, acquired = _lease_transaction(owner, ttl, time.time())
+            self._set(path, update(self._get(path)))
+            return acquired[0]
+
+    async def release_lease(self, path: str, owner: str) -> None:
+        async with self._lock:
+            self._set(path, _release_transaction(owner)(self._get(path)))
+
+    async def add_judge(self, jury_type: str, chat_id: int, max_limit: Optional[int]) -> str:
+        async with self._lock:
+            update, outcome = _judge_transaction(chat_id, max_limit)
+            self._set(f"judges_{jury_type}", update(self._get(f"judges_{jury_type}")))
+            return outcome[0]
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from metrics import FIREBASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def merge_change(pending: Dict[str, Any], path: str, value: Any) -> None:
+    """Unisce una modifica `path -> value` in un insieme di modifiche pendenti.
+
+    Firebase rifiuta un update che contiene sia un percorso sia un suo
+    discendente: se un antenato è già pendente la modifica viene applicata
+    dentro il suo valore, altrimenti i discendenti pendenti vengono scartati.
+    """
+    for ancestor in _ancestors(path):
+        if ancestor in pending:
+            relative = path[len(ancestor):].lstrip("/")
+            base = pending[ancestor]
+            if not isinstance(base, dict):
+                base = {}
+                pending[ancestor] = base
+            _apply(base, relative.split("/"), value)
+            return
+    prefix = path + "/"
+    for key in [k for k in pending if k.startswith(prefix)]:
+        del pending[key]
+    pending[path] = value
+
+
+def _ancestors(path: str):
+    parts = path.split("/")
+    for i in range(1, len(parts)):
+        yield "/".join(parts[:i])
+
+
+def _apply(tree: dict, parts: list, value: Any) -> None:
+    for part in parts[:-1]:
+        child = tree.get(part)
+        if not isinstance(child, dict):
+            child = {}
+            tree[part] = child
+        tree = child
+    if value is None:
+        tree.pop(parts[-1], None)
+    else:
+        tree[parts[-1]] = value
+
+
+class BotDataStore:
+    """Scrive bot_data su Firebase fuori dall'event loop.
+
+    Le chiamate all'SDK di Firebase sono bloccanti: vengono eseguite in un
+    executor a thread singolo (così l'ordine delle scritture è preservato),
+    in modo che gli handler non aspettino mai il round-trip HTTP.
+
+    Le modifiche (`percorso -> valore`) finiscono in un buffer write-behind
+    e vengono fuse con merge_change: il buffer viene scritto dopo
+    `flush_interval` secondi dalla prima modifica, oppure subito dopo
+    `max_batch` modifiche, con un solo `update()` multi-path.
+
+    `mutations` conta le modifiche ricevute, `flushes` le scritture
+    effettivamente inviate a Firebase.
+
+    L'SDK di Firebase viene importato e inizializzato solo alla prima
+    lettura o scrittura, nel thread dell'executor, per non rallentare
+    l'avvio del server.
+
+    I valori passati allo store non devono essere modificati dopo l'invio.
+    """
+
+    def __init__(self, ref_path: str = "bot_data", flush_interval: float = 0.2, max_batch: int = 50,
+                 credentials_path: Optional[str] = None, database_url: Optional[str] = None):
+        self.ref_path = ref_path
+        self.credentials_path = credentials_path
+        self.database_url = database_url
+        self._init_lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.mutations = 0
+        self.flushes = 0
+        self._pending: Dict[str, Any] = {}
+        self._batch_size = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._dirty: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        if self._writer is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="firebase")
+        self._dirty = asyncio.Event()
+        self._full = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer = asyncio.create_task(self._run_writer())
+
+    async def load(self) -> dict:
+        """Legge l'intero documento senza bloccare il loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._read)
+
+    async def run(self, fn, executor: Optional[ThreadPoolExecutor] = None):
+        """Esegue `fn(ref)` nel thread di Firebase (letture puntuali, transazioni).
+
+        Con `executor` la chiamata usa un altro pool e non aspetta in coda
+        dietro le scritture del buffer.
+        """
+        loop = asyncio.get_running_loop()
+        def call():
+            with FIREBASE_SECONDS.time(operation="run"):
+                return fn(self._reference())
+
+        return await loop.run_in_executor(executor or self._executor, call)
+
+    def update(self, changes: Dict[str, Any]) -> None:
+        """Accoda solo i percorsi modificati (valore None = elimina)."""
+        if changes:
+            self._enqueue(changes)
+
+    def _enqueue(self, changes: Dict[str, Any]) -> None:
+        self.mutations += 1
+        if self._writer is None:
+            # Store non ancora avviato (es. script esterni): scrittura diretta
+            self.flushes += 1
+            self._write(dict(changes))
+            return
+        for path, value in changes.items():
+            merge_change(self._pending, path, value)
+        self._batch_size += 1
+        self._idle.clear()
+        self._dirty.set()
+        if self._batch_size >= self.max_batch:
+            self._full.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> None:
+        """Scrive subito il buffer e attende che la scrittura sia completata."""
+        if self._writer is None or self._idle.is_set():
+            return
+        self._full.set()
+        await self._idle.wait()
+
+    async def shutdown(self) -> None:
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        logger.info("Persistenza chiusa: %d modifiche, %d scritture su Firebase.", self.mutations, self.flushes)
+
+    async def _run_writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._dirty.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty.clear()
+            self._full.clear()
+            changes, self._pending = self._pending, {}
+            self._batch_size = 0
+            if changes:
+                self.flushes += 1
+                await loop.run_in_executor(self._executor, self._write, changes)
+            if not self._pending:
+                self._idle.set()
+
+    def _reference(self):
+        import firebase_admin
+        from firebase_admin import credentials, db
+
+        with self._init_lock:
+            try:
+                firebase_admin.get_app()
+            except ValueError:
+                firebase_admin.initialize_app(credentials.Certificate(self.credentials_path), {
+                    'databaseURL': self.database_url
+                })
+        return db.reference(self.ref_path)
+
+    def _read(self) -> dict:
+        with FIREBASE_SECONDS.time(operation="read"):
+            return self._reference().get()
+
+    def _write(self, changes: Dict[str, Any]) -> None:
+        try:
+            ref = self._reference()
+            with FIREBASE_SECONDS.time(operation="update"):
+                ref.update(changes)
+        except Exception as e:
+            logger.error("Errore nel salvataggio dei dati su Firebase: %s", e, extra={"sample": True})
@@ -35,7 +35,9 @@ def get_benvenuto_prop_text(update: Update) -> str:
         "_Inoltre potrai cambiare, a tuo piacimento, le password per effettuare il login\\._\n"
         "_\\- /artisti, da qui avrai la possibilità di aggiungere o rimuovere gli artisti che verranno poi votati dalla giuria\\._\n"
         "_\\- /votazioni, quando tutto sarà pronto usa questo comando per far comparire la tastiera con tutti gli artisti, premendo su un nome_ " 
-        "_darai inizio alle votazioni per quel singolo artista\\._\n\n"
+        "_darai inizio alle votazioni per quel singolo artista\\._\n"
+        "_\\- /classifica, mostra la classifica provvisoria per categoria mentre le votazioni sono in corso\\._\n"
+        "_\\- /formula, mostra o cambia il calcolo della classifica \\(media, mediana, media troncata, pesi delle giurie\\)\\._\n\n"
         "*Spero sia tutto chiaro, detto ciò, in bocca al lupo e buon festival\\!*"
     )
     return text
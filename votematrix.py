@@ -0,0 +1,264 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from artisti import DEFAULT_CATEGORY
+from scoring import ScoringEngine
+
+
+class _Interner:
+    """Assegna a ogni chiave (artista o giudice) un indice intero progressivo."""
+
+    __slots__ = ("index", "keys")
+
+    def __init__(self):
+        self.index: Dict[object, int] = {}
+        self.keys: List[object] = []
+
+    def get(self, key) -> Optional[int]:
+        return self.index.get(key)
+
+    def add(self, key) -> int:
+        i = self.index.get(key)
+        if i is None:
+            i = self.index[key] = len(self.keys)
+            self.keys.append(key)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def _grow(array: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+    """Array con almeno `shape` celle per asse (capacità raddoppiata), NaN nelle nuove celle."""
+    if all(size <= current for size, current in zip(shape, array.shape)):
+        return array
+    new_shape = tuple(current if size <= current else max(size, current * 2)
+                      for size, current in zip(shape, array.shape))
+    grown = np.full(new_shape, np.nan, dtype=array.dtype)
+    grown[tuple(slice(0, n) for n in array.shape)] = array
+    return grown
+
+
+def _mean(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    return np.divide(sums, counts, out=np.zeros(sums.shape, dtype=np.float64), where=counts > 0)
+
+
+class VoteMatrix:
+    """Voti in array NumPy compatti invece che in dict annidati.
+
+    Artisti e giudici vengono convertiti in indici interi (i giudici
+    popolari e tecnici hanno indici separati), gli ambiti tecnici usano la
+    loro posizione in `ambiti`. I voti sono float32 in due matrici, NaN dove
+    manca il voto:
+
+    - popolare: artista × giudice
+    - tecnica:  artista × giudice × ambito
+
+    Medie e conteggi per artista e per ambito vengono calcolati con
+    riduzioni vettoriali e tenuti in cache finché `version` non cambia.
+    La classifica usa i punteggi di `scoring` (ScoringEngine), calcolati
+    sulle stesse matrici; con la formula di default coincidono con le medie.
+    StandingsCache e le notifiche leggono average, count, ambito_average e
+    ranking; `to_votes()` restituisce la forma annidata usata da Firebase.
+    """
+
+    def __init__(self, ambiti: List[str], artists: int = 16, judges: int = 64,
+                 scoring: Optional[ScoringEngine] = None):
+        self.ambiti = list(ambiti)
+        self.scoring = self._check_scoring(scoring or ScoringEngine())
+        self._ambito_index = {ambito: i for i, ambito in enumerate(self.ambiti)}
+        self.version = 0
+        self._artists = _Interner()
+        self._judges_popolare = _Interner()
+        self._judges_tecnica = _Interner()
+        self._popolare = np.full((artists, judges), np.nan, dtype=np.float32)
+        self._tecnica = np.full((artists, judges, len(self.ambiti)), np.nan, dtype=np.float32)
+        self._stats_version: Optional[int] = None
+        self._stats: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_votes(cls, ambiti: List[str], votes_popolare: dict, votes_tecnica: dict) -> "VoteMatrix":
+        matrix = cls(ambiti)
+        matrix.rebuild(votes_popolare, votes_tecnica)
+        return matrix
+
+    def rebuild(self, votes_popolare: dict, votes_tecnica: dict) -> None:
+        """Sostituisce tutti i voti con quelli in forma annidata (es. caricati da Firebase)."""
+        self.clear()
+        for artist_key, users in votes_popolare.items():
+            for user_id, score in users.items():
+                self.add_popolare(artist_key, user_id, score)
+        for artist_key, users in votes_tecnica.items():
+            for user_id, aspects in users.items():
+                for ambito, score in aspects.items():
+                    self.add_tecnica(artist_key, user_id, ambito, score)
+
+    def clear(self) -> None:
+        # version continua a crescere: le classifiche in cache restano invalide
+        version = self.version
+        self.__init__(self.ambiti, scoring=self.scoring)
+        self.version = version + 1
+
+    def set_scoring(self, scoring: ScoringEngine) -> None:
+        """Cambia la formula della classifica; le classifiche in cache vengono ricalcolate."""
+        self.scoring = self._check_scoring(scoring)
+        self.version += 1
+
+    def _check_scoring(self, scoring: ScoringEngine) -> ScoringEngine:
+        weights = scoring.config.ambito_weights
+        if weights and len(weights) != len(self.ambiti):
+            raise ValueError(f"Servono {len(self.ambiti)} pesi degli ambiti, ricevuti {len(weights)}")
+        return scoring
+
+    # --- scrittura e lettura dei singoli voti ---
+
+    def _artist_row(self, artist_key: str) -> int:
+        # popolare e tecnica condividono gli indici degli artisti: crescono insieme
+        a = self._artists.add(artist_key)
+        if a >= self._popolare.shape[0] or a >= self._tecnica.shape[0]:
+            self._popolare = _grow(self._popolare, (a + 1, self._popolare.shape[1]))
+            self._tecnica = _grow(self._tecnica, (a + 1,) + self._tecnica.shape[1:])
+        return a
+
+    def add_popolare(self, artist_key: str, user_id, score: float) -> None:
+        a = self._artist_row(artist_key)
+        j = self._judges_popolare.add(user_id)
+        self._popolare = _grow(self._popolare, (a + 1, j + 1))
+        self._popolare[a, j] = score
+        self.version += 1
+
+    def add_tecnica(self, artist_key: str, user_id, ambito: str, score: float) -> None:
+        a = self._artist_row(artist_key)
+        j = self._judges_tecnica.add(user_id)
+        self._tecnica = _grow(self._tecnica, (a + 1, j + 1, len(self.ambiti)))
+        self._tecnica[a, j, self._ambito_index[ambito]] = score
+        self.version += 1
+
+    def remove_artist(self, artist_key: str) -> None:
+        """Elimina i voti dell'artista (l'indice resta assegnato, la chiave non viene riutilizzata)."""
+        a = self._artists.get(artist_key)
+        if a is None:
+            return
+        self._popolare[a] = np.nan
+        self._tecnica[a] = np.nan
+        self.version += 1
+
+    def _cell(self, array: np.ndarray, a: Optional[int], j: Optional[int]) -> Optional[np.ndarray]:
+        """Riga del giudice per l'artista (o il singolo voto popolare); None se fuori dalla matrice."""
+        if a is None or j is None or a >= array.shape[0] or j >= array.shape[1]:
+            return None
+        return array[a, j]
+
+    def has_popolare(self, artist_key: str, user_id) -> bool:
+        score = self._cell(self._popolare, self._artists.get(artist_key), self._judges_popolare.get(user_id))
+        return score is not None and not np.isnan(score)
+
+    def has_tecnica(self, artist_key: str, user_id, ambito: str) -> bool:
+        scores = self._cell(self._tecnica, self._artists.get(artist_key), self._judges_tecnica.get(user_id))
+        return scores is not None and not np.isnan(scores[self._ambito_index[ambito]])
+
+    def ballot(self, artist_key: str, user_id) -> Dict[str, float]:
+        """Voti per ambito di un giudice tecnico per l'artista."""
+        scores = self._cell(self._tecnica, self._artists.get(artist_key), self._judges_tecnica.get(user_id))
+        if scores is None:
+            return {}
+        return {
+            ambito: float(score)
+            for ambito, score in zip(self.ambiti, scores)
+            if not np.isnan(score)
+        }
+
+    def to_votes(self) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+        """votes_popolare e votes_tecnica in forma annidata."""
+        votes_popolare: Dict[str, dict] = {}
+        votes_tecnica: Dict[str, dict] = {}
+        for a, j in zip(*np.nonzero(~np.isnan(self._popolare))):
+            votes_popolare.setdefault(self._artists.keys[a], {})[self._judges_popolare.keys[j]] = \
+                float(self._popolare[a, j])
+        for a, j, k in zip(*np.nonzero(~np.isnan(self._tecnica))):
+            votes_tecnica.setdefault(self._artists.keys[a], {}).setdefault(
+                self._judges_tecnica.keys[j], {})[self.ambiti[k]] = float(self._tecnica[a, j, k])
+        return votes_popolare, votes_tecnica
+
+    @property
+    def nbytes(self) -> int:
+        return self._popolare.nbytes + self._tecnica.nbytes
+
+    # --- riduzioni vettoriali ---
+
+    def _compute(self) -> Dict[str, np.ndarray]:
+        if self._stats_version == self.version:
+            return self._stats
+        n = len(self._artists)
+        popolare = self._popolare[:n, :len(self._judges_popolare)]
+        tecnica = self._tecnica[:n, :len(self._judges_tecnica)]
+
+        pop_voted = ~np.isnan(popolare)
+        pop_count = pop_voted.sum(axis=1)
+        pop_mean = _mean(np.nansum(popolare, axis=1, dtype=np.float64), pop_count)
+
+        # la scheda di un giudice tecnico vale la media degli ambiti votati
+        tech_voted = ~np.isnan(tecnica)
+        ballot_count = tech_voted.sum(axis=2)
+        ballot_mean = _mean(np.nansum(tecnica, axis=2, dtype=np.float64), ballot_count)
+        tech_count = (ballot_count > 0).sum(axis=1)
+        tech_mean = _mean(ballot_mean.sum(axis=1), tech_count)
+
+        ambito_mean = _mean(np.nansum(tecnica, axis=1, dtype=np.float64), tech_voted.sum(axis=1))
+
+        if self.scoring.plain_mean:
+            # formula di default: le medie appena calcolate sono già i punteggi
+            scores = {"popolare": pop_mean, "tecnica": tech_mean,
+                      "overall": self.scoring.combine(pop_mean, tech_mean)}
+        else:
+            scores = self.scoring.score(popolare, tecnica)
+
+        self._stats = {
+            "popolare": pop_mean, "popolare_count": pop_count,
+            "tecnica": tech_mean, "tecnica_count": tech_count,
+            "ambiti": ambito_mean,
+            "score_popolare": scores["popolare"], "score_tecnica": scores["tecnica"],
+            "score": scores["overall"],
+        }
+        self._stats_version = self.version
+        return self._stats
+
+    def average(self, artist_key: str, jury_type: str) -> float:
+        a = self._artists.get(artist_key)
+        return float(self._compute()[jury_type][a]) if a is not None else 0.0
+
+    def count(self, artist_key: str, jury_type: str) -> int:
+        a = self._artists.get(artist_key)
+        return int(self._compute()[f"{jury_type}_count"][a]) if a is not None else 0
+
+    def ambito_average(self, artist_key: str, ambito: str) -> float:
+        a = self._artists.get(artist_key)
+        return float(self._compute()["ambiti"][a, self._ambito_index[ambito]]) if a is not None else 0.0
+
+    def ranking(self, artists: Dict[str, dict],
+                default_category: str = DEFAULT_CATEGORY) -> Dict[str, list]:
+        """Classifica per categoria: liste di (punteggio, artist_key, popolare, tecnica) secondo `scoring`."""
+        stats = self._compute()
+        if hasattr(artists, "by_category"):
+            groups = {categoria: list(artists.by_category(categoria)) for categoria in artists.categories()}
+        else:
+            groups = {}
+            for artist_key, artist in artists.items():
+                groups.setdefault(artist.get("categoria", default_category), []).append(artist_key)
+        ranking: Dict[str, list] = {}
+        for categoria, keys in groups.items():
+            # indici nella matrice; -1 per gli artisti senza voti
+            rows = np.array([self._artists.index.get(key, -1) for key in keys], dtype=np.int64)
+            known = rows >= 0
+            pop = np.zeros(len(keys))
+            tech = np.zeros(len(keys))
+            overall = np.zeros(len(keys))
+            pop[known] = stats["score_popolare"][rows[known]]
+            tech[known] = stats["score_tecnica"][rows[known]]
+            overall[known] = stats["score"][rows[known]]
+            order = np.argsort(-overall, kind="stable")
+            ranking[categoria] = [
+                (float(overall[i]), keys[i], float(pop[i]), float(tech[i])) for i in order
+            ]
+        return ranking